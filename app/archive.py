@@ -0,0 +1,133 @@
+import tarfile
+import gzip
+import os
+
+
+EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def compressed_writer(raw, compression=None):
+    """Wraps a binary file so everything written to it is compressed.
+
+    Args:
+        raw (file): A binary file opened for writing.
+        compression (str): gzip, zstd (which needs the zstandard package) or None.
+
+    Returns:
+        file: A binary file object.  Closing it flushes the compressed stream and closes raw.
+
+    """
+    if compression == "gzip":
+        return _ClosingGzip(raw)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+    return raw
+
+
+class _ClosingGzip(gzip.GzipFile):
+    def __init__(self, raw):
+        super().__init__(fileobj=raw, mode="wb", filename="")
+        self.destination = raw
+
+    def close(self):
+        super().close()
+        self.destination.close()
+
+
+def open_compressed(path):
+    """Opens a file for reading, decompressing it if it ends with .gz or .zst.
+
+    Args:
+        path (str): The file to open.
+
+    Returns:
+        file: A binary file object.
+
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def read_archive(path):
+    """Yields each member of a tar archive written by RollingArchive, one at a time.
+
+    Args:
+        path (str): A .tar, .tar.gz or .tar.zst file.
+
+    Returns:
+        generator: Tuples with the member name and a file object to read it from.
+
+    """
+    with open_compressed(path) as stream, tarfile.open(fileobj=stream, mode="r|") as archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, archive.extractfile(member)
+
+
+class RollingArchive:
+    def __init__(self, directory, prefix="foxml", compression="gzip", max_size=1024):
+        """Streams files into a series of compressed tar archives, starting a new one once max_size is reached.
+
+        Args:
+            directory (str): Where to write the archives.
+            prefix (str): The start of each archive name, like foxml for foxml_0001.tar.gz.
+            compression (str): gzip, zstd or None.
+            max_size (int): Megabytes to write to an archive before starting the next one.
+
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_size = max_size * 1048576
+        self.archives = []
+        self.raw = None
+        self.writer = None
+        self.tar = None
+
+    def __repr__(self):
+        return f"Rolling archive of {len(self.archives)} parts in {self.directory}."
+
+    def __str__(self):
+        return f"Rolling archive of {len(self.archives)} parts in {self.directory}."
+
+    def add(self, name, source, size):
+        """Adds a file to the current archive.
+
+        Args:
+            name (str): The name of the file in the archive.
+            source (file): A binary file object to read the file from.
+            size (int): The number of bytes to read from source.
+
+        Returns:
+            str: The name of the archive the file was added to.
+
+        """
+        if self.tar is None or self.raw.tell() >= self.max_size:
+            self._roll()
+        member = tarfile.TarInfo(name)
+        member.size = size
+        self.tar.addfile(member, source)
+        return self.archives[-1]
+
+    def _roll(self):
+        self.close()
+        name = f"{self.prefix}_{len(self.archives) + 1:04d}.tar{EXTENSIONS[self.compression]}"
+        self.raw = open(os.path.join(self.directory, name), "wb")
+        self.writer = compressed_writer(self.raw, self.compression)
+        self.tar = tarfile.open(fileobj=self.writer, mode="w|")
+        self.archives.append(name)
+        return
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.writer.close()
+            if not self.raw.closed:
+                self.raw.close()
+            self.tar = None
+        return
@@ -0,0 +1,232 @@
+import requests
+from requests.structures import CaseInsensitiveDict
+import sqlite3
+import threading
+import atexit
+import json
+import time
+import os
+
+
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+TOUCH_BATCH = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, headers TEXT,
+                                      content BLOB, size INTEGER, stored REAL, last_access REAL);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+caches = {}
+shared_session = None
+session_lock = threading.Lock()
+
+
+class HttpCache:
+    def __init__(self, path, max_size=512, ttl=0, session=None):
+        """Opens (or creates) an on-disk cache of metadata responses.
+
+        Responses are keyed by the user and the URL, so credentials that see different things (like gsearch and
+        fedora) never share an entry, and are stored with their ETag and Last-Modified headers.  Stale entries are
+        revalidated with a conditional request, so an unchanged object costs a 304 instead of a full response.  Access
+        times are written in batches of TOUCH_BATCH rather than on every hit.
+
+        Args:
+            path (str): The path to the SQLite file that holds the cache.
+            max_size (int): The size in megabytes the cache may grow to before the least recently used responses are
+                evicted.
+            ttl (int): Seconds a response is served without revalidating it.  0 always revalidates.
+            session (requests.Session): The session to revalidate with.  Defaults to a new one.
+
+        """
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.path = path
+        self.max_size = max_size * 1024 * 1024
+        self.ttl = ttl
+        self.session = session if session is not None else requests.Session()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0}
+        self.touched = {}
+        atexit.register(self.flush)
+
+    def __repr__(self):
+        return f"HTTP cache stored at {self.path}."
+
+    def __str__(self):
+        return f"HTTP cache stored at {self.path}."
+
+    def get(self, url, auth=None):
+        """Requests a URL, answering from the cache when the stored response is fresh or Fedora returns a 304.
+
+        Args:
+            url (str): The URL to request.
+            auth (tuple): A username and password for the request.
+
+        Returns:
+            requests.Response: The live response, or a response rebuilt from the cache with a 200 status.
+
+        Examples:
+            >>> HttpCache("cache/http_cache.db").get("http://localhost:8080/fedora/objects/test:4/datastreams?profiles=true")
+            <Response [200]>
+
+        """
+        key = f"{auth[0]}@{url}" if auth else url
+        with self.lock:
+            entry = self.connection.execute("SELECT etag, last_modified, headers, content, stored FROM responses "
+                                            "WHERE url = ?", (key,)).fetchone()
+            refreshed = self.touched.get(key, (None, None))[1]
+        conditions = {}
+        if entry is not None:
+            etag, last_modified, headers, content, stored = entry
+            stored = refreshed or stored
+            if self.ttl and time.time() - stored < self.ttl:
+                self.stats["hits"] += 1
+                self._touch(key)
+                return self._response(url, headers, content)
+            if etag:
+                conditions["If-None-Match"] = etag
+            if last_modified:
+                conditions["If-Modified-Since"] = last_modified
+        r = self.session.get(url, auth=auth, headers=conditions)
+        if r.status_code == 304 and entry is not None:
+            self.stats["revalidated"] += 1
+            self._touch(key, refresh=True)
+            return self._response(url, entry[2], entry[3])
+        self.stats["misses"] += 1
+        if r.status_code == 200 and (self.ttl or "ETag" in r.headers or "Last-Modified" in r.headers):
+            self._store(key, r)
+        return r
+
+    def _touch(self, key, refresh=False):
+        now = time.time()
+        with self.lock:
+            stored = now if refresh else self.touched.get(key, (None, None))[1]
+            self.touched[key] = (now, stored)
+            if len(self.touched) >= TOUCH_BATCH:
+                self._write_touches()
+                self.connection.commit()
+
+    def _write_touches(self):
+        self.connection.executemany("UPDATE responses SET last_access = ?, stored = COALESCE(?, stored) WHERE url = ?",
+                                    [(last_access, stored, key) for key, (last_access, stored) in self.touched.items()])
+        self.touched = {}
+
+    def flush(self):
+        """Writes access times still waiting for a batch.
+
+        Returns:
+            None
+
+        """
+        with self.lock:
+            if self.touched:
+                self._write_touches()
+                self.connection.commit()
+        return
+
+    def _store(self, key, r):
+        headers = {header: r.headers[header] for header in STORED_HEADERS if header in r.headers}
+        now = time.time()
+        with self.lock:
+            self.touched.pop(key, None)
+            self._write_touches()
+            previous = self.connection.execute("SELECT size FROM responses WHERE url = ?", (key,)).fetchone()
+            if previous is not None:
+                self.total_size -= previous[0]
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (key, r.headers.get("ETag"), r.headers.get("Last-Modified"), json.dumps(headers),
+                                     r.content, len(r.content), now, now))
+            self.total_size += len(r.content)
+            if self.total_size > self.max_size:
+                self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        target = self.max_size * 0.9
+        for url, size in self.connection.execute("SELECT url, size FROM responses ORDER BY last_access").fetchall():
+            if self.total_size <= target:
+                break
+            self.connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.total_size -= size
+
+    @staticmethod
+    def _response(url, headers, content):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = content
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+    def clear(self):
+        with self.lock:
+            self.touched = {}
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+            self.total_size = 0
+        return
+
+
+def get_session(yaml_settings):
+    """Returns the requests session shared by every request to Fedora and Solr, creating it on first use.
+
+    Its connection pool holds max_workers connections, so concurrent requests reuse them, and a daemon keeps them warm
+    between calls.
+
+    Args:
+        yaml_settings (dict): A dict of various setting predefined by the user in a config file.
+
+    Returns:
+        requests.Session: The shared session.
+
+    """
+    global shared_session
+    with session_lock:
+        if shared_session is None:
+            shared_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=yaml_settings.get("max_workers", 8))
+            shared_session.mount("http://", adapter)
+            shared_session.mount("https://", adapter)
+    return shared_session
+
+
+def get_cache(yaml_settings):
+    """Returns the shared HttpCache for a config, or None if http_cache isn't set.
+
+    Args:
+        yaml_settings (dict): A dict of various setting predefined by the user in a config file.
+
+    Returns:
+        HttpCache: The cache shared by every Set and Record using the same http_cache path.
+
+    """
+    path = yaml_settings.get("http_cache")
+    if not path:
+        return None
+    if path not in caches:
+        caches[path] = HttpCache(path, yaml_settings.get("http_cache_size", 512), yaml_settings.get("http_cache_ttl", 0),
+                                 get_session(yaml_settings))
+    return caches[path]
+
+
+def cached_get(url, yaml_settings, auth=None):
+    """Requests a metadata URL through the shared cache when one is configured.
+
+    Args:
+        url (str): The URL to request.
+        yaml_settings (dict): A dict of various setting predefined by the user in a config file.
+        auth (tuple): A username and password for the request.
+
+    Returns:
+        requests.Response: The response from Fedora or the cache.
+
+    """
+    cache = get_cache(yaml_settings)
+    if cache is None:
+        return get_session(yaml_settings).get(url, auth=auth)
+    return cache.get(url, auth)
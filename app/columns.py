@@ -0,0 +1,60 @@
+from array import array
+
+
+class InternedColumn:
+    def __init__(self, values=()):
+        """Stores one findObjects field for every PID in a Set.
+
+        Each distinct value is kept once and the column itself is an array of integer codes, so fields with few
+        distinct values like state or ownerId cost about four bytes per object.
+
+        Args:
+            values (iterable): Values to append, in the same order as the PIDs they belong to.
+
+        """
+        self.values = []
+        self.lookup = {}
+        self.codes = array('I')
+        for value in values:
+            self.append(value)
+
+    def __repr__(self):
+        return f"A column of {len(self.codes)} values with {len(self.values)} distinct values."
+
+    def __str__(self):
+        return f"A column of {len(self.codes)} values with {len(self.values)} distinct values."
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, position):
+        return self.values[self.codes[position]]
+
+    def __iter__(self):
+        for code in self.codes:
+            yield self.values[code]
+
+    def append(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.lookup[value] = code
+        self.codes.append(code)
+        return
+
+    def counts(self):
+        """Returns how many rows hold each distinct value.
+
+        Returns:
+            dict: A dict with each distinct value and the number of rows holding it.
+
+        Examples:
+            >>> InternedColumn(['A', 'A', 'I']).counts()
+            {'A': 2, 'I': 1}
+
+        """
+        totals = [0] * len(self.values)
+        for code in self.codes:
+            totals[code] += 1
+        return {value: totals[code] for code, value in enumerate(self.values)}
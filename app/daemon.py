@@ -0,0 +1,65 @@
+import socketserver
+import contextlib
+import traceback
+import json
+import io
+import os
+
+
+class Daemon:
+    def __init__(self, socket_path, handler):
+        """Listens on a Unix socket and runs the run.py arguments each client sends.
+
+        Requests are handled one at a time in this process, so the HTTP cache and its connection pool, imported
+        modules and result sets loaded by earlier requests stay warm.  Everything the operation prints, including
+        progress bars, is streamed back to the client.
+
+        Args:
+            socket_path (str): The path of the Unix socket to listen on.
+            handler (function): Called with the list of arguments from each request.
+
+        """
+        self.socket_path = socket_path
+        self.handler = handler
+
+    def __repr__(self):
+        return f"Whitebread daemon listening on {self.socket_path}."
+
+    def __str__(self):
+        return f"Whitebread daemon listening on {self.socket_path}."
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                request = json.loads(self.rfile.readline())
+                output = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True)
+                if request.get("stop"):
+                    output.write("Stopping the whitebread daemon.\n")
+                    self.server.stopping = True
+                    return
+                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                    try:
+                        daemon.handler(request["argv"])
+                    except SystemExit:
+                        pass
+                    except Exception:
+                        traceback.print_exc()
+                output.flush()
+                output.detach()
+
+        server = socketserver.UnixStreamServer(self.socket_path, RequestHandler)
+        server.stopping = False
+        print(f"Whitebread daemon listening on {self.socket_path}.")
+        try:
+            while not server.stopping:
+                server.handle_request()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(self.socket_path)
+        return
@@ -1,15 +1,42 @@
 from lxml import etree
 import requests
 import os
-from PIL import Image
-from io import BytesIO
 import yaml
 from tqdm import tqdm
 import collections
 import xmltodict
-from bs4 import BeautifulSoup
 import json
 import urllib.request
+import urllib.parse
+import threading
+import hashlib
+import time
+import re
+import shutil
+import datetime
+import csv
+import tempfile
+from app.cache import cached_get, get_session
+from app.columns import InternedColumn
+from app.index import rdf_triples, rdf_statements, RELS_EXT, ISLANDORA, EMBARGO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from app.pipeline import Pipeline, Stage, WriteBehindWriter
+from app.images import transform_image
+from app.verify import verify_directory, mime_extension
+from app.solr import dc_fields
+from app.archive import RollingArchive, compressed_writer, EXTENSIONS
+
+
+SPOOL_SIZE = 1048576
+NAMESPACE_CHARACTERS = list("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ-.")
+ID_CHARACTERS = NAMESPACE_CHARACTERS + ["~"]
+REMAINDER_CHARACTERS = {"_": "%5C_", "%": "%5C%25"}
+PROFILE_FIELDS = {"label": "objLabel", "state": "objState", "ownerId": "objOwnerId", "cDate": "objCreateDate",
+                  "mDate": "objLastModDate"}
+UPPER_CHARACTERS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+page_tuning = {}
+page_tuning_lock = threading.Lock()
+SOLR_FIELDS = {"label": "label", "state": "state", "ownerId": "owner_id", "cDate": "created", "mDate": "modified"}
 
 
 class Set:
@@ -26,6 +53,8 @@ class Set:
         self.request = search_string
         self.settings = yaml_settings
         self.token = ""
+        self.column_pids = []
+        self.columns = {}
 
     def __repr__(self):
         return f"A set of records based on the following http request:\n\t{self.request}."
@@ -33,12 +62,16 @@ class Set:
     def __str__(self):
         return f"A set of records based on the following http request:\n\t{self.request}."
 
-    def populate(self):
+    def populate(self, fields=()):
         """Populates the results property of the Sets instance.
 
         Populates the results property of the Sets instance with every pid that is associated with a request. The
         results property is intended to be used by all other methods to determine which pids the method should be run
-        against.
+        against.  Any other findObjects fields that are requested are stored column-wise in the columns property, in
+        the same order as column_pids, so reports on them need no further requests.
+
+        Args:
+            fields (tuple): Other findObjects fields to capture, like label, state, ownerId, cDate or mDate.
 
         Returns:
             None
@@ -46,21 +79,278 @@ class Set:
         Examples:
             >>>Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).populate()
             None
+            >>>Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).populate(("state", "mDate"))
+            None
 
         """
-        document = etree.parse(f"{self.request}{self.token}")
+        fields = [field for field in fields if field != "pid"]
+        field_parameters = "".join(f"&{field}=true" for field in fields)
+        r = get_session(self.settings).get(f"{self.request}{field_parameters}{self.token}")
+        document = etree.fromstring(r.content).getroottree()
         token = document.xpath('//types:token', namespaces={"types": "http://www.fedora.info/definitions/1/0/types/"})
-        results = document.findall('//{http://www.fedora.info/definitions/1/0/types/}pid')
+        results = document.findall('//{http://www.fedora.info/definitions/1/0/types/}objectFields')
         print(".", end="", flush=True)
+        for field in fields:
+            if field not in self.columns:
+                self.columns[field] = InternedColumn()
         for result in results:
-            self.results.append(result.text)
+            pid = result.findtext('{http://www.fedora.info/definitions/1/0/types/}pid')
+            self.results.append(pid)
             self.size += 1
+            if len(fields) > 0:
+                self.column_pids.append(pid)
+                for field in fields:
+                    self.columns[field].append(result.findtext(f'{{http://www.fedora.info/definitions/1/0/types/}}'
+                                                               f'{field}'))
         if len(token) == 1:
             self.token = f"&sessionToken={token[0].text}"
         else:
             self.token = None
         return
 
+    def populate_all(self, fields=(), partition=False):
+        """Pages through every result of the request, optionally splitting the query into partitions.
+
+        With partition, a query for pid~PREFIX* is split into one query per possible next character of the PID, or
+        of the object id after the colon when PREFIX is a whole namespace.  Each partition is paged in its own
+        session, max_workers at a time, and the results are merged in order.  Before fanning out, one PID is looked up
+        with its case swapped; if Fedora finds it, PID matching ignores case and the upper-case partitions, which
+        would repeat the lower-case ones, are left out.  A PID that matches more than one partition is kept only once.
+
+        Because _ and % are wildcards in some databases, object ids starting with them aren't partitions of their own;
+        they're found by a remainder query that escapes them with a backslash, and only PIDs that really start with
+        them are kept.  On databases where a backslash doesn't escape, like Derby, the remainder finds nothing, so
+        don't partition namespaces with such PIDs there.
+
+        Fedora keeps the page size of a session's first page, so the page size is tuned between sessions: each session,
+        partitioned or not, starts at the size learned so far for this Fedora, which doubles (up to max_page_size) when
+        a full first page came back in less than half of page_target_seconds, and halves (down to 10) when a first
+        page took longer than page_target_seconds.  The learned size is kept for the life of the process, so a daemon
+        carries it from one populate to the next.
+
+        Args:
+            fields (tuple): Other findObjects fields to capture, like label, state, ownerId, cDate or mDate.
+            partition (bool): Split the query by PID prefix and page the partitions concurrently.
+
+        Returns:
+            None
+
+        Examples:
+            >>>Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).populate_all(("state",), True)
+            None
+
+        """
+        match = re.search(r"query=pid%7E([^*&]*)\*", self.request)
+        tuning = self._page_tuning()
+        if not partition or match is None:
+            if partition:
+                print("\nOnly queries with a parent namespace can be partitioned.", end="", flush=True)
+            self._populate_session(fields, tuning)
+            return
+        prefix = match.group(1)
+        namespace_characters = NAMESPACE_CHARACTERS
+        id_characters = ID_CHARACTERS
+        if self._ignores_case(prefix):
+            namespace_characters = [character for character in NAMESPACE_CHARACTERS if character not in UPPER_CHARACTERS]
+            id_characters = [character for character in ID_CHARACTERS if character not in UPPER_CHARACTERS]
+        if ":" in prefix or "%3A" in prefix.upper():
+            id_prefix = prefix
+            prefixes = []
+        else:
+            id_prefix = f"{prefix}:"
+            prefixes = [f"{prefix}{character}" for character in namespace_characters]
+        prefixes += [f"{id_prefix}{character}" for character in id_characters]
+        prefixes += [f"{id_prefix}{escaped}" for escaped in REMAINDER_CHARACTERS.values()]
+        remainder_position = len(urllib.parse.unquote(id_prefix))
+
+        def populate_partition(partition_prefix):
+            partition_set = Set(self.request.replace(f"pid%7E{prefix}*", f"pid%7E{partition_prefix}*", 1),
+                                self.settings)
+            partition_set._populate_session(fields, tuning)
+            return partition_set
+
+        with ThreadPoolExecutor(self.settings.get("max_workers", 8)) as executor:
+            partitions = list(executor.map(populate_partition, prefixes))
+        seen = set(self.results)
+        fields = [field for field in fields if field != "pid"]
+        for field in fields:
+            if field not in self.columns:
+                self.columns[field] = InternedColumn()
+        for partition_prefix, partition_set in zip(prefixes, partitions):
+            remainder = partition_prefix.endswith(tuple(REMAINDER_CHARACTERS.values()))
+            for position, pid in enumerate(partition_set.results):
+                if pid in seen:
+                    continue
+                if remainder and pid[remainder_position:remainder_position + 1] not in REMAINDER_CHARACTERS:
+                    continue
+                seen.add(pid)
+                self.results.append(pid)
+                if len(fields) > 0:
+                    self.column_pids.append(pid)
+                    for field in fields:
+                        self.columns[field].append(partition_set.columns[field][position])
+        self.size = len(self.results)
+        self.token = None
+        return
+
+    def _page_tuning(self):
+        with page_tuning_lock:
+            if self.settings["fedora_path"] not in page_tuning:
+                page_tuning[self.settings["fedora_path"]] = {
+                    "size": int(re.search(r"maxResults=(\d+)", self.request).group(1)), "lock": threading.Lock()}
+            return page_tuning[self.settings["fedora_path"]]
+
+    def _ignores_case(self, prefix):
+        probe = Set(re.sub(r"maxResults=\d+", "maxResults=1", self.request), self.settings)
+        probe.populate()
+        if len(probe.results) == 0 or probe.results[0].swapcase() == probe.results[0]:
+            return False
+        pid = probe.results[0]
+        swapped = Set(re.sub(r"maxResults=\d+", "maxResults=25", self.request).replace(
+            f"pid%7E{prefix}*", f"pid%7E{urllib.parse.quote(pid.swapcase(), safe='')}*", 1), self.settings)
+        swapped.populate()
+        return any(result[:len(pid)] == pid for result in swapped.results)
+
+    def _populate_session(self, fields, tuning):
+        with tuning["lock"]:
+            page_size = tuning["size"]
+        self.request = re.sub(r"maxResults=\d+", f"maxResults={page_size}", self.request)
+        started = time.monotonic()
+        self.populate(fields)
+        elapsed = time.monotonic() - started
+        target = self.settings.get("page_target_seconds", 2)
+        with tuning["lock"]:
+            if elapsed < target / 2 and len(self.results) >= page_size:
+                tuning["size"] = max(tuning["size"], min(page_size * 2, self.settings.get("max_page_size", 1000)))
+            elif elapsed > target:
+                tuning["size"] = min(tuning["size"], max(page_size // 2, 10))
+        while self.token is not None:
+            self.populate(fields)
+        return
+
+    def load_results(self, pids, columns=None):
+        """Fills the results property from a list of PIDs instead of paginating the request.
+
+        Args:
+            pids (list): PIDs from a saved result set or a PID file.
+            columns (dict): Optional field values saved with the result set, as lists in the same order as pids.
+
+        Returns:
+            None
+
+        Examples:
+            >>>Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).load_results(['test:4', 'test:5'])
+            None
+
+        """
+        self.results = list(pids)
+        self.size = len(self.results)
+        self.token = None
+        if columns:
+            self.column_pids = list(pids)
+            self.columns = {field: InternedColumn(values) for field, values in columns.items()}
+        return
+
+    def group_by_field(self, field):
+        """Groups the result set by a field captured by populate.
+
+        If the field wasn't captured, like when the set came from a PID file, it's read with load_fields() first.
+
+        Args:
+            field (str): A findObjects field that was passed to populate, like state or ownerId.
+
+        Returns:
+            dict: A dict with each value of the field, the number of PIDs with it, and the PIDs.
+
+        Examples:
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).group_by_field("state")
+            {'A': {'count': 2, 'pids': ['test:4', 'test:5']}, 'I': {'count': 1, 'pids': ['test:6']}}
+
+        """
+        if field not in self.columns:
+            self.load_fields((field,))
+        current = set(self.results) if len(self.results) != len(self.column_pids) else None
+        groups = {}
+        for pid, value in zip(self.column_pids, self.columns[field]):
+            if current is not None and pid not in current:
+                continue
+            if value not in groups:
+                groups[value] = {'count': 1, 'pids': [pid]}
+            else:
+                groups[value]['count'] += 1
+                groups[value]['pids'].append(pid)
+        return groups
+
+    def load_fields(self, fields):
+        """Fills columns for fields that populate didn't capture by reading each object's profile.
+
+        Used when a set was loaded from a PID file or a saved result set without the fields an operation needs.
+        Profiles are requested max_workers at a time.
+
+        Args:
+            fields (tuple): findObjects fields to fill: label, state, ownerId, cDate or mDate.
+
+        Returns:
+            None
+
+        Examples:
+            >>>Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).load_fields(("state",))
+            None
+
+        """
+        fields = [field for field in fields if field not in self.columns]
+        for field in fields:
+            if field not in PROFILE_FIELDS:
+                raise ValueError(f"{field} can't be read from object profiles. Populate the set with "
+                                 f"fields=('{field}',).")
+        if len(fields) == 0:
+            return
+        if len(self.column_pids) == 0:
+            self.column_pids = list(self.results)
+        print(f"\n\nReading {', '.join(fields)} for {len(self.column_pids)} objects.\n")
+        with ThreadPoolExecutor(self.settings.get("max_workers", 8)) as executor:
+            profiles = list(tqdm(executor.map(self._object_profile, self.column_pids), total=len(self.column_pids)))
+        for field in fields:
+            self.columns[field] = InternedColumn(profile.get(PROFILE_FIELDS[field]) for profile in profiles)
+        return
+
+    def _object_profile(self, pid):
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}?format=xml",
+                       self.settings, auth=(self.settings['username'], self.settings['password']))
+        if r.status_code != 200:
+            return {}
+        return xmltodict.parse(r.text)['objectProfile']
+
+    def objects_by_state(self):
+        """Groups the result set by object state.
+
+        Returns:
+            dict: The same dict as group_by_field("state").
+
+        """
+        return self.group_by_field("state")
+
+    def modified_since(self, a_date):
+        """Finds PIDs modified on or after a date using the mDate captured by populate.
+
+        Args:
+            a_date (str): The date as yyyy-MM-dd or a full xsd:dateTime.
+
+        Returns:
+            dict: A dict with the date, the PIDs modified since then, and the total.
+
+        Examples:
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).modified_since('2019-11-12')
+            {'date requested': '2019-11-12', 'PIDs modified': ['test:5'], 'Total modified': 1}
+
+        """
+        if "mDate" not in self.columns:
+            self.load_fields(("mDate",))
+        current = set(self.results)
+        modified = [pid for pid, value in zip(self.column_pids, self.columns["mDate"])
+                    if pid in current and value is not None and value >= a_date]
+        return {"date requested": a_date, "PIDs modified": modified, "Total modified": len(modified)}
+
     def count_objects(self):
         """Returns number of pids that match query.
 
@@ -101,22 +391,94 @@ class Set:
         else:
             os.mkdir(self.settings["destination_directory"])
         errors = []
-        for result in tqdm(self.results):
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/"
-                             f"datastreams/{dsid}/content",
-                             auth=(self.settings['username'], self.settings['password']))
-            r.encoding = "utf-8"
-            if r.status_code == 200:
-                new_name = result.replace(":", "_")
-                ext = r.headers["Content-Type"].split(";")[0].split("/")[1]
-                with open(f"{self.settings['destination_directory']}/{new_name}.{ext}", "w") as new_file:
-                    new_file.write(r.text)
-            else:
-                errors.append((result, r.status_code))
-                print(f"Could not harvest metadata for {result}: {r.status_code}.")
+        for output in self.download(self.object_jobs(f"datastreams/{dsid}/content"), text=True):
+            if "error" in output:
+                errors.append((output["pid"], output["error"]))
+                print(f"Could not harvest metadata for {output['pid']}: {output['error']}.")
         print(f"\n\nDownloaded {len(self.results)} {dsid} records.")
         return {"Attempted Downloads": len(self.results), "dsid": dsid, "errors": errors}
 
+    def object_jobs(self, suffix):
+        """Yields a download job for each result.
+
+        Args:
+            suffix (str): The part of the url after /fedora/objects/PID/, like datastreams/MODS/content.
+
+        Returns:
+            generator: Dicts with the PID, the file name to use without an extension, and the url to request.
+
+        """
+        for result in self.results:
+            yield {"pid": result, "name": result.replace(":", "_"),
+                   "url": f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/{suffix}"}
+
+    def download(self, jobs, text=False, expand=None, convert=None):
+        """Downloads jobs to destination_directory through a fetch, transform and write-behind pipeline.
+
+        Fetching runs max_workers requests at a time, checking responses and deriving file extensions runs on
+        transform_workers threads, and files are written and synced in batches of write_batch_size by a single
+        writer, so a slow disk doesn't stall the network or the other way around.  At most queue_size items wait
+        between stages, so no more than about 2 * queue_size + max_workers + transform_workers + write_batch_size
+        responses are held in memory at once.
+
+        Args:
+            jobs (iterable): Dicts with a pid, a file name without an extension, and a url, like from object_jobs().
+            text (bool): Decode the response as utf-8 text instead of writing the raw bytes.
+            expand (function): An optional first stage that turns each job into a list of jobs.
+            convert (function): Called with each saved job before it is written, and returns a new data and
+                extension.  Runs on the transform threads.
+
+        Returns:
+            list: The jobs in the order of results.  Saved jobs have a file and path; the rest have an error with the
+            http status code or the exception that was raised.
+
+        """
+        workers = self.settings.get("max_workers", 8)
+        session = get_session(self.settings)
+        auth = (self.settings['username'], self.settings['password'])
+
+        def fetch(job):
+            job["response"] = session.get(job["url"], auth=auth)
+            return job
+
+        def transform(job):
+            r = job.pop("response")
+            if r.status_code != 200:
+                job["error"] = r.status_code
+                return job
+            ext = mime_extension(r.headers.get("Content-Type"))
+            job["file"] = f"{job['name']}.{ext}"
+            job["path"] = f"{self.settings['destination_directory']}/{job['file']}"
+            if text:
+                r.encoding = "utf-8"
+                job["data"] = r.text.encode("utf-8")
+            else:
+                job["data"] = r.content
+            if convert is not None:
+                job["data"], ext = convert(job["data"])
+                job["file"] = f"{job['name']}.{ext}"
+                job["path"] = f"{self.settings['destination_directory']}/{job['file']}"
+            return job
+
+        transform_workers = self.settings.get("transform_workers", 1)
+        if convert is not None:
+            transform_workers = max(transform_workers, self.settings.get("image_workers") or os.cpu_count() or 1)
+        stages = [Stage(fetch, workers, "fetch"), Stage(transform, transform_workers, "transform")]
+        if expand is not None:
+            stages.insert(0, Stage(expand, workers, "expand"))
+        pipeline = Pipeline(stages, WriteBehindWriter(self.settings.get("write_batch_size", 64),
+                                                      self.settings.get("fsync_writes", True)),
+                            self.settings.get("queue_size", 64))
+        outputs = pipeline.run(jobs, len(self.results) if expand is None else None)
+        for job, error in pipeline.errors:
+            job.pop("response", None)
+            job.pop("data", None)
+            job["error"] = repr(error)
+            outputs.append(job)
+        order = {result: position for position, result in enumerate(self.results)}
+        outputs.sort(key=lambda output: (order.get(output["pid"], len(order)), output["name"]))
+        return outputs
+
     def find_content_types(self):
         """Returns all content models found in a request.
 
@@ -137,22 +499,30 @@ class Set:
                 content_types.append(x)
         return content_types
 
-    def grab_images(self, dsid="TN"):
-        """Attempts to serialize an image to disk. (Deprecated)
+    def grab_images(self, dsid="TN", image_format=None, max_dimension=None, colorspace=None):
+        """Serializes an image datastream to disk, optionally converting it.
 
-        This is an old method that was used for downloading images.  I highly recommend using grab_binary() instead.
+        Without a transform, images are written byte for byte like grab_binary().  When image_format, max_dimension
+        or colorspace is set, each image is decoded and re-encoded with Pillow in a pool of image_workers processes
+        while other images are still downloading.
 
         Args:
             dsid (str): The image datastream id to download.  Defaults to TN.
+            image_format (str): Save images in this format, like png or jpeg.
+            max_dimension (int): Shrink images so neither side is longer than this.
+            colorspace (str): Convert images to sRGB, Gray or CMYK.
 
         Returns:
             dict: A dict with the number of attempted downloads, the datastream id that was passed, and a list of errors
-            as tuples with the PID and the http status code.
+            as tuples with the PID and the http status code or the error raised converting the image.
 
         Examples:
             >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).grab_images("TN")
             {'Attempted Downloads': 3, 'dsid': 'TN', 'errors': []}
 
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).grab_images("OBJ", "png", 1000)
+            {'Attempted Downloads': 3, 'dsid': 'OBJ', 'errors': [('test:3', 404)]}
+
         """
         if self.settings["destination_directory"] in os.listdir("."):
             pass
@@ -160,18 +530,14 @@ class Set:
             os.mkdir(self.settings["destination_directory"])
         if dsid is None:
             dsid = self.settings["default_dsid"]
-        errors = []
-        for result in tqdm(self.results):
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/"
-                             f"datastreams/{dsid}/content",
-                             auth=(self.settings['username'], self.settings['password']))
-            if r.status_code == 200:
-                ext = r.headers["Content-Type"].split(";")[0].split("/")[1]
-                in_file = Image.open(BytesIO(r.content))
-                new_name = result.replace(":", "_")
-                in_file.save(f"{self.settings['destination_directory']}/{new_name}.{ext}")
-            else:
-                errors.append((result, r.status_code))
+        jobs = self.object_jobs(f"datastreams/{dsid}/content")
+        if image_format is None and max_dimension is None and colorspace is None:
+            outputs = self.download(jobs)
+        else:
+            with ProcessPoolExecutor(self.settings.get("image_workers")) as pool:
+                outputs = self.download(jobs, convert=lambda data: pool.submit(
+                    transform_image, data, image_format, max_dimension, colorspace).result())
+        errors = [(output["pid"], output["error"]) for output in outputs if "error" in output]
         return {"Attempted Downloads": len(self.results), "dsid": dsid, "errors": errors}
 
     def grab_binary(self, dsid="OBJ"):
@@ -197,18 +563,8 @@ class Set:
             pass
         else:
             os.mkdir(self.settings["destination_directory"])
-        errors = []
-        for result in tqdm(self.results):
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/"
-                             f"datastreams/{dsid}/content",
-                             auth=(self.settings['username'], self.settings['password']))
-            if r.status_code == 200:
-                new_name = result.replace(":", "_")
-                ext = r.headers["Content-Type"].split(";")[0].split("/")[1]
-                with open(f"{self.settings['destination_directory']}/{new_name}.{ext}", 'wb') as other:
-                    other.write(r.content)
-            else:
-                errors.append((result, r.status_code))
+        errors = [(output["pid"], output["error"])
+                  for output in self.download(self.object_jobs(f"datastreams/{dsid}/content")) if "error" in output]
         return {"Attempted Downloads": self.results, "dsid": dsid, "errors": errors}
 
     def write_datastream_history(self, dsid, result_format="xml"):
@@ -237,18 +593,9 @@ class Set:
             pass
         else:
             os.mkdir(self.settings["destination_directory"])
-        errors = []
-        for result in tqdm(self.results):
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/"
-                             f"datastreams/{dsid}/history?format={result_format}",
-                             auth=(self.settings['username'], self.settings['password']))
-            if r.status_code == 200:
-                new_name = result.replace(":", "_")
-                ext = r.headers["Content-Type"].split(";")[0].split("/")[1]
-                with open(f"{self.settings['destination_directory']}/{new_name}.{ext}", "w") as new_file:
-                    new_file.write(r.text)
-            else:
-                errors.append((result, r.status_code))
+        errors = [(output["pid"], output["error"])
+                  for output in self.download(self.object_jobs(f"datastreams/{dsid}/history?format={result_format}"),
+                                              text=True) if "error" in output]
         return {"Attempted Downloads": self.results, "dsid": dsid, "format": result_format, "errors": errors,
                 "destination_directory": self.settings['destination_directory']}
 
@@ -279,22 +626,190 @@ class Set:
             pass
         else:
             os.mkdir(self.settings["destination_directory"])
-        errors = []
-        for result in tqdm(self.results):
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/"
-                             f"datastreams/{dsid}/content?asOfDateTime={a_date}",
-                             auth=(self.settings['username'], self.settings['password']))
-            if r.status_code == 200:
-                new_name = result.replace(":", "_")
-                ext = r.headers["Content-Type"].split(";")[0].split("/")[1]
-                with open(f"{self.settings['destination_directory']}/{new_name}.{ext}", 'wb') as other:
-                    other.write(r.content)
-            else:
-                errors.append((result, r.status_code))
+        errors = [(output["pid"], output["error"])
+                  for output in self.download(self.object_jobs(f"datastreams/{dsid}/content?asOfDateTime={a_date}"))
+                  if "error" in output]
         return {"Attempted downloads": self.results, "Downloads attempted": len(self.results), "dsid": dsid,
                 "date requested": a_date, "errors": errors,
                 "destination_directory": self.settings['destination_directory']}
 
+    def export_snapshot(self, dsid, a_date):
+        """Serializes the version of a datastream that was current on a date for every result, with a manifest.
+
+        The version for each PID is chosen from its (cached) datastream history, so only versions that exist are
+        requested, and they're requested concurrently.  If an earlier snapshot of the same dsid exists, versions it
+        already holds are hard linked from it instead of being downloaded, and downloads whose sha1 matches its copy
+        are linked too.  Snapshots are written to destination_directory/snapshots/DSID_DATE with a manifest.json
+        recording the version, date, checksums and file of every PID.
+
+        Args:
+            dsid (str): The datastream id to snapshot.
+            a_date (str): The date as yyyy-MM-dd or a full xsd:dateTime.
+
+        Returns:
+            dict: A dict with the number of PIDs checked, the number of files downloaded, the number reused from the
+            previous snapshot, the PIDs with no version on that date, a list of errors as tuples with the PID and the
+            http status code, and the snapshot directory.
+
+        Examples:
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).export_snapshot('MODS',
+            ... '2019-11-12')
+            {'PIDs checked': 3, 'Downloaded': 1, 'Reused': 2, 'PIDs without version': [], 'errors': [],
+            'snapshot_directory': 'output/snapshots/MODS_2019-11-12'}
+
+        """
+        snapshots = os.path.join(self.settings["destination_directory"], "snapshots")
+        directory = os.path.join(snapshots, f"{dsid}_{a_date}")
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        cutoff = a_date if "T" in a_date else f"{a_date}T00:00:00.000Z"
+        previous = self._previous_snapshot(snapshots, dsid, a_date)
+        print(f"\n\nFinding the {dsid} version for each object on {a_date}.\n")
+        with ThreadPoolExecutor(self.settings.get("max_workers", 8)) as executor:
+            entries = list(tqdm(executor.map(lambda pid: self._snapshot_entry(pid, dsid, cutoff, directory,
+                                                                               previous),
+                                             self.results), total=len(self.results)))
+        objects = {}
+        errors = []
+        missing = []
+        downloaded = reused = 0
+        for pid, entry in zip(self.results, entries):
+            if entry is None:
+                missing.append(pid)
+            elif "error" in entry:
+                errors.append((pid, entry["error"]))
+            else:
+                if entry.pop("reused"):
+                    reused += 1
+                else:
+                    downloaded += 1
+                objects[pid] = entry
+        with open(os.path.join(directory, "manifest.json"), "w") as manifest:
+            json.dump({"dsid": dsid, "date": a_date, "objects": objects}, manifest, indent=1)
+        return {"PIDs checked": len(self.results), "Downloaded": downloaded, "Reused": reused,
+                "PIDs without version": missing, "errors": errors, "snapshot_directory": directory}
+
+    @staticmethod
+    def _previous_snapshot(snapshots, dsid, a_date):
+        earlier = sorted(name for name in os.listdir(snapshots) if name.startswith(f"{dsid}_")
+                         and name < f"{dsid}_{a_date}"
+                         and os.path.exists(os.path.join(snapshots, name, "manifest.json")))
+        if len(earlier) == 0:
+            return None
+        with open(os.path.join(snapshots, earlier[-1], "manifest.json"), "r") as manifest:
+            previous = json.load(manifest)
+        previous["directory"] = os.path.join(snapshots, earlier[-1])
+        return previous
+
+    def _snapshot_entry(self, pid, dsid, cutoff, directory, previous):
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/"
+                       f"datastreams/{dsid}/history?format=xml", self.settings,
+                       auth=(self.settings['username'], self.settings['password']))
+        if r.status_code == 404:
+            return None
+        if r.status_code != 200:
+            return {"error": r.status_code}
+        versions = xmltodict.parse(r.text)['datastreamHistory']['datastreamProfile']
+        if type(versions) is not list:
+            versions = [versions]
+        versions = [version for version in versions if version['dsCreateDate'] <= cutoff]
+        if len(versions) == 0:
+            return None
+        version = max(versions, key=lambda current: current['dsCreateDate'])
+        ext = mime_extension(version.get('dsMIME'))
+        entry = {"version": version['dsVersionID'], "created": version['dsCreateDate'],
+                 "checksum_type": version.get('dsChecksumType'), "checksum": version.get('dsChecksum'),
+                 "file": f"{pid.replace(':', '_')}.{ext}", "reused": False}
+        path = os.path.join(directory, entry["file"])
+        old = previous["objects"].get(pid) if previous is not None else None
+        if old is not None and old["version"] == entry["version"] and old["created"] == entry["created"]:
+            entry["sha1"] = old["sha1"]
+            entry["reused"] = self._link(os.path.join(previous["directory"], old["file"]), path)
+            if entry["reused"]:
+                return entry
+        content = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/"
+                               f"datastreams/{dsid}/content?asOfDateTime={entry['created']}",
+                               auth=(self.settings['username'], self.settings['password']))
+        if content.status_code != 200:
+            return {"error": content.status_code}
+        entry["sha1"] = hashlib.sha1(content.content).hexdigest()
+        if old is not None and old["sha1"] == entry["sha1"]:
+            entry["reused"] = self._link(os.path.join(previous["directory"], old["file"]), path)
+            if entry["reused"]:
+                return entry
+        with open(path, "wb") as other:
+            other.write(content.content)
+        return entry
+
+    @staticmethod
+    def _link(source, destination):
+        if not os.path.exists(source):
+            return False
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+        return True
+
+    def verify_files(self, dsid, directory=None):
+        """Checks that files downloaded for a datastream still match Fedora without downloading them again.
+
+        The size and checksum of each datastream is read from its profile, max_workers at a time, and the local files
+        are hashed in a pool of hash_workers processes.  Files are expected to be named like grab_binary() and harvest_metadata()
+        name them.
+
+        Args:
+            dsid (str): The datastream id the files were downloaded from.
+            directory (str): Where the files are.  Defaults to destination_directory.
+
+        Returns:
+            dict: A dict with the number of files expected and verified, lists of mismatched, missing, extra and
+            unchecked files, and a list of errors as tuples with the PID and the http status code or exception.
+
+        Examples:
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).verify_files("OBJ")
+            {'Files expected': 3, 'verified': 2, 'mismatched': [{'file': 'test_4.jpeg', 'pid': 'test:4',
+            'expected size': 1061, 'size': 332}], 'missing': [], 'extra': ['test_9.jpeg'], 'unchecked': [],
+            'directory': 'output', 'errors': [('test:3', 404)]}
+
+        """
+        if directory is None:
+            directory = self.settings["destination_directory"]
+        def read(pid):
+            try:
+                return self._checksum_details(pid, dsid)
+            except Exception as error:
+                return {"error": repr(error)}
+
+        print(f"\n\nReading {dsid} checksums from Fedora.\n")
+        with ThreadPoolExecutor(self.settings.get("max_workers", 8)) as executor:
+            profiles = list(tqdm(executor.map(read, self.results), total=len(self.results)))
+        expected = {}
+        errors = []
+        for pid, profile in zip(self.results, profiles):
+            if "error" in profile:
+                if profile["error"] != 404:
+                    errors.append((pid, profile["error"]))
+                continue
+            expected[f"{pid.replace(':', '_')}.{profile.pop('ext')}"] = profile
+        print(f"\n\nChecking {len(expected)} files in {directory}.\n")
+        report = verify_directory(expected, directory, self.settings.get("hash_workers"))
+        report["errors"] = errors
+        return report
+
+    def _checksum_details(self, pid, dsid):
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/"
+                       f"datastreams/{dsid}?format=xml", self.settings,
+                       auth=(self.settings['username'], self.settings['password']))
+        if r.status_code != 200:
+            return {"error": r.status_code}
+        profile = xmltodict.parse(r.text)['datastreamProfile']
+        return {"pid": pid, "ext": mime_extension(profile.get('dsMIME')),
+                "size": int(profile.get('dsSize') or 0), "checksum_type": profile.get('dsChecksumType'),
+                "checksum": profile.get('dsChecksum')}
+
     def write_all_versions_of_datastream(self, dsid):
         """Serializes all versions of a datastream related to a query to disk.
 
@@ -333,45 +848,23 @@ class Set:
             os.mkdir(self.settings["destination_directory"])
         errors = []
         serialized_files = []
-        for result in tqdm(self.results):
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/"
-                             f"datastreams/{dsid}/history?format=xml",
-                             auth=(self.settings['username'], self.settings['password']))
-            if r.status_code == 200:
-                json_response = json.loads(json.dumps(xmltodict.parse(r.text)['datastreamHistory']))
-                for version in json_response['datastreamProfile']:
-                    if type(version) is dict:
-                        version_title = version['dsCreateDate']
-                        current_version = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/"
-                                                       f"objects/{result}/datastreams/{dsid}/content?asOfDateTime="
-                                                       f"{version['dsCreateDate']}",
-                                                       auth=(self.settings['username'], self.settings['password']))
-                        if current_version.status_code == 200:
-                            new_name = result.replace(":", "_")
-                            ext = current_version.headers["Content-Type"].split(";")[0].split("/")[1]
-                            with open(f"{self.settings['destination_directory']}/{new_name}_{version_title}.{ext}", 'wb') as other:
-                                other.write(current_version.content)
-                            serialized_files.append(f'{new_name}_{version_title}.{ext}')
-                        else:
-                            errors.append((f'{result}_{version_title}.'
-                                           f'{current_version.headers["Content-Type"].split(";")[0].split("/")[1]}',
-                                           r.status_code))
-                    elif type(version) is str:
-                        version_title = json_response['datastreamProfile']['dsCreateDate']
-                        current_version = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/"
-                                                       f"objects/{result}/datastreams/{dsid}/content?asOfDateTime="
-                                                       f"{json_response['datastreamProfile']['dsCreateDate']}",
-                                                       auth=(self.settings['username'], self.settings['password']))
-                        if current_version.status_code == 200:
-                            new_name = result.replace(":", "_")
-                            ext = current_version.headers["Content-Type"].split(";")[0].split("/")[1]
-                            with open(f"{self.settings['destination_directory']}/{new_name}_{version_title}.{ext}", 'wb') as other:
-                                other.write(current_version.content)
-                            serialized_files.append(f'{new_name}_{version_title}.{ext}')
-                        else:
-                            errors.append((f'{result}_{version_title}.'
-                                           f'{current_version.headers["Content-Type"].split(";")[0].split("/")[1]}',
-                                           r.status_code))
+
+        def versions(job):
+            r = cached_get(f"{job['url']}/history?format=xml", self.settings,
+                           auth=(self.settings['username'], self.settings['password']))
+            if r.status_code != 200:
+                return None
+            profiles = xmltodict.parse(r.text)['datastreamHistory']['datastreamProfile']
+            if type(profiles) is not list:
+                profiles = [profiles]
+            return [{"pid": job["pid"], "name": f"{job['name']}_{version['dsCreateDate']}",
+                     "url": f"{job['url']}/content?asOfDateTime={version['dsCreateDate']}"} for version in profiles]
+
+        for output in self.download(self.object_jobs(f"datastreams/{dsid}"), expand=versions):
+            if "error" in output:
+                errors.append((f"{output['pid']}_{output['name'].split('_')[-1]}", output["error"]))
+            else:
+                serialized_files.append(output["file"])
         return {"Attempted downloads": self.results, "PIDs attempted": len(self.results), "dsid": dsid,
                 "serialized_files": serialized_files, "errors": errors,
                 "destination_directory": self.settings['destination_directory']}
@@ -405,6 +898,7 @@ class Set:
              'test:6'], 'Total updated': 3, 'errors': [], 'Total failed': 0}
 
         """
+        from bs4 import BeautifulSoup
         successes = []
         errors = []
         print("\n\nUpdating gsearch\n")
@@ -431,6 +925,68 @@ class Set:
         return {"PIDs attempted": self.results, "Total attempts": len(self.results), "PIDs updated": successes,
                 "Total updated": len(successes), "errors": errors, "Total failed": len(errors)}
 
+    def index_solr(self, indexer):
+        """Posts a Solr document for each result straight to Solr's update handler instead of through fedoragsearch.
+
+        The DC and (when the field mapping uses it) MODS of each result are read through the cache max_workers at a
+        time, and the documents are posted in batches as they're built, with one commit at the end.  Object properties
+        come from the label, state, ownerId, cDate and mDate columns captured by populate, and the object profile is
+        only read for results without them.
+
+        Args:
+            indexer (SolrIndexer): Builds the documents and posts them.
+
+        Returns:
+            dict: A dict with the number of PIDs attempted, the documents posted, the number of batches, whether the
+            commit worked, and a list of errors as tuples with the PID and the http status code or the exception.
+
+        Examples:
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).index_solr(SolrIndexer(
+            ...     "http://localhost:8080/solr/collection1"))
+            {'Documents posted': 3, 'Batches': 1, 'Committed': True, 'errors': [], 'PIDs attempted': 3}
+
+        """
+        positions = {}
+        if all(field in self.columns for field in SOLR_FIELDS):
+            positions = {pid: position for position, pid in enumerate(self.column_pids)}
+
+        def build(pid):
+            properties = None
+            if pid in positions:
+                properties = {name: self.columns[field][positions[pid]] for field, name in SOLR_FIELDS.items()}
+            try:
+                return self._solr_details(pid, indexer, properties)
+            except Exception as error:
+                return {"error": repr(error)}
+
+        print("\n\nBuilding and posting Solr documents.\n")
+        with ThreadPoolExecutor(self.settings.get("max_workers", 8)) as executor:
+            for pid, details in zip(self.results, tqdm(executor.map(build, self.results), total=len(self.results))):
+                if "error" in details:
+                    indexer.errors.append((pid, details["error"]))
+                else:
+                    indexer.add(pid, details["document"])
+        report = indexer.finish()
+        report["PIDs attempted"] = len(self.results)
+        return report
+
+    def _solr_details(self, pid, indexer, properties=None):
+        url = f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}"
+        auth = (self.settings['username'], self.settings['password'])
+        if properties is None:
+            r = cached_get(f"{url}?format=xml", self.settings, auth=auth)
+            if r.status_code != 200:
+                return {"error": r.status_code}
+            profile = xmltodict.parse(r.text)['objectProfile']
+            properties = {name: profile.get(PROFILE_FIELDS[field]) for field, name in SOLR_FIELDS.items()}
+        r = cached_get(f"{url}/datastreams/DC/content", self.settings, auth=auth)
+        dc = dc_fields(r.content) if r.status_code == 200 else None
+        mods = None
+        if indexer.needs_mods():
+            r = cached_get(f"{url}/datastreams/MODS/content", self.settings, auth=auth)
+            mods = r.content if r.status_code == 200 else None
+        return {"document": indexer.document(pid, properties, dc, mods)}
+
     def find_objects_missing_datastream(self, dsid):
         """Find PIDs without a certain dsid.
 
@@ -452,9 +1008,9 @@ class Set:
         """
         missing = []
         for result in tqdm(self.results):
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/"
-                             f"objects/{result}/datastreams/{dsid}",
-                             auth=(self.settings['username'], self.settings['password']))
+            r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/"
+                           f"objects/{result}/datastreams/{dsid}",
+                           self.settings, auth=(self.settings['username'], self.settings['password']))
             if r.status_code != 200:
                 missing.append(result)
         return {"PIDs Checked": self.results, "dsid": dsid, "PIDs missing dsid": missing,
@@ -462,9 +1018,9 @@ class Set:
 
     def get_relationships(self):
         for i in tqdm(self.results):
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/"
-                             f"objects/{i}/relationships", auth=(f"{self.settings['username']}",
-                                                                 f"{self.settings['password']}"))
+            r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/"
+                           f"objects/{i}/relationships", self.settings,
+                           auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
             if r.status_code == 200:
                 print(r.text)
         return
@@ -475,9 +1031,9 @@ class Set:
         for i in tqdm(self.results):
             predicate = "&predicate=info:fedora/fedora-system:def/relations-external#" \
                         f"{relationship}".replace(":", "%3a").replace("/", "%2f").replace("#", "%23")
-            r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/"
-                             f"objects/{i}/relationships?subject=info%3afedora%2f{i}&format=turtle{predicate}",
-                             auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
+            r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/"
+                           f"objects/{i}/relationships?subject=info%3afedora%2f{i}&format=turtle{predicate}",
+                           self.settings, auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
             if r.status_code == 200:
                 new_list = r.text.split(">")
                 if len(new_list) == 4:
@@ -489,6 +1045,175 @@ class Set:
                     membership_list.append(new_item)
         return membership_list
 
+    def find_pages_per_book(self):
+        """Counts the pages of each book in a result set.
+
+        Returns:
+            list: A list of dicts with the PID of each book, the number of pages found, the local identifier from its
+            MODS, and the extent from its MODS.
+
+        Examples:
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).find_pages_per_book()
+            [{'name': 'test:1', 'pages': 3, 'admindb': '0012_000001', 'extent_pages': '3 pages'}]
+
+        """
+        books = []
+        book_list = []
+        for result in self.results:
+            new_record = Record(result)
+            relationships = new_record.find_rels_ext_relationship("isMemberOf")
+            if relationships is not None:
+                print(f"Finding parent of page {result}.")
+                parent = Record(relationships["isMemberOf"])
+                if parent.pid not in books:
+                    books.append(parent.pid)
+                    try:
+                        label = parent.get_parent_label("//mods:identifier[@type='local']")
+                    except IndexError:
+                        label = "missing"
+                    except OSError:
+                        label = "Access Denied"
+                    try:
+                        extent = parent.get_parent_label("//mods:extent")
+                    except IndexError:
+                        extent = "missing"
+                    except OSError:
+                        extent = "Access Denied"
+                    book_list.append({"name": parent.pid, "pages": 1, "admindb": label, "extent_pages": extent})
+                else:
+                    for book in book_list:
+                        if book["name"] == parent.pid:
+                            book["pages"] += 1
+        return book_list
+
+    def update_labels(self, xpath):
+        """Updates the label of every object in a result set from MODS.
+
+        Pages are labelled with their book's title and page number and everything else with the text matching xpath
+        in its own MODS.  Relationships and current labels are requested concurrently, each book's MODS is requested
+        once no matter how many pages it has, objects whose live label already matches are skipped, and the remaining
+        labels are written concurrently.  Labels are always read from Fedora rather than a saved result set or the
+        cache, so a stale copy never causes a write to be skipped.  Every label written and every failure is added to
+        update_labels_log.txt as it happens, so the log is complete even if the run is interrupted.
+
+        Args:
+            xpath (str): An xpath to the label in MODS, like "//mods:titleInfo/mods:title".
+
+        Returns:
+            dict: A dict with the number of PIDs checked, the PIDs updated, the PIDs skipped because their label
+            already matched, the PIDs whose MODS didn't match the xpath, and a list of errors as tuples with the PID
+            and the http status code or exception.
+
+        Examples:
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).update_labels(
+            ... "//mods:titleInfo/mods:title")
+            {'Total checked': 3, 'PIDs updated': ['test:5'], 'PIDs unchanged': ['test:4', 'test:6'],
+            'PIDs without a match': [], 'errors': [], 'Total updated': 1}
+
+        """
+        workers = self.settings.get("max_workers", 8)
+        session = get_session(self.settings)
+        updated = []
+        errors = []
+        with open("update_labels_log.txt", "w") as my_log:
+            print("\n\nFinding pages and current labels.\n")
+            with ThreadPoolExecutor(workers) as executor:
+                details = []
+                for detail in tqdm(executor.map(lambda pid: self._label_details(session, pid), self.results),
+                                   total=len(self.results)):
+                    if "error" in detail:
+                        errors.append((detail["pid"], detail["error"]))
+                        my_log.write(f"Could not read the label of {detail['pid']}: {detail['error']}.\n")
+                    else:
+                        details.append(detail)
+            label_sources = []
+            for detail in details:
+                source = detail["parent"] if detail["parent"] is not None else detail["pid"]
+                if source not in label_sources:
+                    label_sources.append(source)
+            print(f"\n\nReading {len(label_sources)} MODS records for {len(details)} objects.\n")
+            with ThreadPoolExecutor(workers) as executor:
+                mods_labels = dict(zip(label_sources, tqdm(executor.map(lambda pid: self._mods_label(pid, xpath),
+                                                                        label_sources), total=len(label_sources))))
+            changes = []
+            unchanged = []
+            unmatched = []
+            for detail in details:
+                source = detail["parent"] if detail["parent"] is not None else detail["pid"]
+                label, error = mods_labels[source]
+                if error is not None:
+                    errors.append((detail["pid"], error))
+                    my_log.write(f"Could not read the MODS of {source} for {detail['pid']}: {error}.\n")
+                    continue
+                if detail["parent"] is not None:
+                    new_label = f"{label}:  page {detail['page']}" if label is not None else None
+                else:
+                    new_label = label
+                if new_label is None:
+                    unmatched.append(detail["pid"])
+                    my_log.write(f"Could not update {detail['pid']}. Xpath did not match text.\n")
+                elif new_label == detail["label"]:
+                    unchanged.append(detail["pid"])
+                else:
+                    changes.append((detail["pid"], new_label))
+            my_log.flush()
+            print(f"\n\nUpdating {len(changes)} labels.\n")
+            with ThreadPoolExecutor(workers) as executor:
+                for (pid, new_label), status_code in zip(changes, tqdm(executor.map(
+                        lambda change: self._put_label(session, *change), changes), total=len(changes))):
+                    if status_code == 200:
+                        updated.append(pid)
+                        my_log.write(f"Updated label for {pid} to {new_label}.\n")
+                    else:
+                        errors.append((pid, status_code))
+                        my_log.write(f"Failed to update label for {pid} to {new_label} with {status_code}.\n")
+                    my_log.flush()
+        return {"Total checked": len(self.results), "PIDs updated": updated, "PIDs unchanged": unchanged,
+                "PIDs without a match": unmatched, "errors": errors, "Total updated": len(updated)}
+
+    def _label_details(self, session, pid):
+        detail = {"pid": pid, "parent": None, "page": None, "label": None}
+        try:
+            r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/"
+                           f"relationships?subject=info%3afedora%2f{pid}", self.settings,
+                           auth=(self.settings['username'], self.settings['password']))
+            if r.status_code == 200:
+                for predicate, value in rdf_triples(r.content):
+                    if predicate == f"{RELS_EXT}isMemberOf":
+                        detail["parent"] = value
+                    elif predicate == f"{ISLANDORA}isPageNumber":
+                        detail["page"] = value
+            r = session.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}?format=xml",
+                            auth=(self.settings['username'], self.settings['password']))
+            if r.status_code == 200:
+                label = etree.fromstring(r.content).xpath("//*[local-name()='objLabel']")
+                detail["label"] = label[0].text if len(label) > 0 else None
+        except (requests.exceptions.RequestException, etree.XMLSyntaxError) as error:
+            detail["error"] = repr(error)
+        return detail
+
+    def _mods_label(self, pid, xpath):
+        try:
+            r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/"
+                           f"datastreams/MODS/content", self.settings,
+                           auth=(self.settings['username'], self.settings['password']))
+            if r.status_code != 200:
+                return None, None
+            label_path = etree.fromstring(r.content).xpath(xpath, namespaces={"mods": "http://www.loc.gov/mods/v3"})
+        except (requests.exceptions.RequestException, etree.XMLSyntaxError) as error:
+            return None, repr(error)
+        if len(label_path) > 0:
+            return label_path[0].text, None
+        return None, None
+
+    def _put_label(self, session, pid, label):
+        try:
+            r = session.put(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}",
+                            params={"label": label}, auth=(self.settings['username'], self.settings['password']))
+        except requests.exceptions.RequestException as error:
+            return repr(error)
+        return r.status_code
+
     def list_dsids(self):
         """Lists all dsids in a result set.
 
@@ -508,7 +1233,8 @@ class Set:
         for result in tqdm(self.results):
             url = f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/" \
                   f"datastreams?profiles=true"
-            r = requests.get(url, auth=(self.settings["gsearch_username"], self.settings["gsearch_password"]))
+            r = cached_get(url, self.settings,
+                           auth=(self.settings["gsearch_username"], self.settings["gsearch_password"]))
             if r.status_code == 200:
                 object_datastreams = json.loads(json.dumps(xmltodict.parse(r.text)))
                 for object_datastream in object_datastreams['objectDatastreams']['datastreamProfile']:
@@ -542,7 +1268,8 @@ class Set:
         for result in tqdm(self.results):
             url = f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{result}/" \
                   f"datastreams?profiles=true"
-            r = requests.get(url, auth=(self.settings["gsearch_username"], self.settings["gsearch_password"]))
+            r = cached_get(url, self.settings,
+                           auth=(self.settings["gsearch_username"], self.settings["gsearch_password"]))
             if r.status_code == 200:
                 object_datastreams = json.loads(json.dumps(xmltodict.parse(r.text)))
                 for object_datastream in object_datastreams['objectDatastreams']['datastreamProfile']:
@@ -553,34 +1280,124 @@ class Set:
                         unique_datastreams[object_datastream['@dsID']]['pids'].append(object_datastream['@pid'])
         return unique_datastreams
 
-    def grab_foxml(self):
-        """Serializes FOXML files to disk.
+    def grab_foxml(self, compression=None, archive_size=None):
+        """Serializes FOXML files to disk, compressed as they stream in.
 
-        Serializes FOXML files to disk for all results in a query.
+        Exports are requested max_workers at a time and written in chunks, so objects with large inline datastreams
+        never have to fit in memory.  With compression, each object is written to PID.xml.gz (gzip) or PID.xml.zst
+        (zstd, which needs the zstandard package).  With archive_size, objects are instead added to tar archives
+        named foxml_0001.tar.gz and so on, and a new archive is started once one reaches archive_size megabytes.  Each
+        export waiting to be archived keeps at most SPOOL_SIZE (1 MB) in memory and spills the rest to a temporary
+        file, so the exports in flight never hold more than about queue_size + max_workers megabytes.  A
+        foxml_manifest.json with every file and its size is written alongside.
+
+        Args:
+            compression (str): gzip, zstd or none.  Defaults to foxml_compression.
+            archive_size (int): Megabytes per archive for a rolling archive.  Defaults to foxml_archive_size.
 
         Returns:
             dict: A dict with the PIDs that were processed, the FOXML files serialized, a list of errors as tuples with
-            PIDs and http staus codes, and the destination directory for where these were serialized.
+            PIDs and http staus codes, the destination directory for where these were serialized, and the manifest.
 
         Examples:
-            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).get_datastream_report()
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).grab_foxml()
             {'PIDs processed': ['test:4', 'test:5', 'test:6'], 'FOXML files': ['test:4.xml', 'test:5.xml',
-            'test:6.xml'], 'errors': [], 'destination_directory': 'output'}
+            'test:6.xml'], 'errors': [], 'destination_directory': 'output', 'manifest': 'output/foxml_manifest.json'}
+
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).grab_foxml("gzip", 1024)
+            {'PIDs processed': ['test:4', 'test:5', 'test:6'], 'FOXML files': ['foxml_0001.tar.gz/test:4.xml',
+            'foxml_0001.tar.gz/test:5.xml', 'foxml_0001.tar.gz/test:6.xml'], 'errors': [],
+            'destination_directory': 'output', 'manifest': 'output/foxml_manifest.json'}
 
         """
-        errors = []
-        successes = []
-        for result in tqdm(self.results):
-            new_record = Record(result)
-            foxml = new_record.grab_foxml()
-            if foxml['status'] is "Success":
-                successes.append(f'{result}.xml')
-                with open(f"{self.settings['destination_directory']}/{result}.xml", "w") as new_file:
-                    new_file.write(foxml['foxml_contents'])
-            else:
-                errors.append(foxml['error'])
-        return {"PIDs processed": self.results, "FOXML files": successes, "errors": errors,
-                "destination_directory": self.settings['destination_directory']}
+        if compression is None:
+            compression = self.settings.get("foxml_compression")
+        if compression == "none":
+            compression = None
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                print("\nzstd compression needs the zstandard package, so using gzip instead.")
+                compression = "gzip"
+        if archive_size is None:
+            archive_size = self.settings.get("foxml_archive_size")
+        directory = self.settings["destination_directory"]
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        workers = self.settings.get("max_workers", 8)
+        session = get_session(self.settings)
+        archive = RollingArchive(directory, "foxml", compression, archive_size) if archive_size else None
+
+        def fetch(pid):
+            r = session.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/export",
+                            auth=(self.settings['username'], self.settings['password']), stream=True)
+            if r.status_code != 200:
+                r.close()
+                return {"pid": pid, "error": r.status_code}
+            item = {"pid": pid, "size": 0}
+            destination = None
+            part = None
+            finished = False
+            try:
+                if archive is not None:
+                    destination = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+                else:
+                    item["file"] = f"{pid}.xml{EXTENSIONS[compression]}"
+                    part = os.path.join(directory, f"{item['file']}.part")
+                    destination = compressed_writer(open(part, "wb"), compression)
+                for chunk in r.iter_content(1048576):
+                    destination.write(chunk)
+                    item["size"] += len(chunk)
+                if archive is not None:
+                    destination.seek(0)
+                    item["spool"] = destination
+                else:
+                    destination.close()
+                    path = os.path.join(directory, item["file"])
+                    os.replace(part, path)
+                    item["stored size"] = os.path.getsize(path)
+                finished = True
+            finally:
+                r.close()
+                if not finished:
+                    if destination is not None:
+                        destination.close()
+                    if part is not None and os.path.exists(part):
+                        os.remove(part)
+            return item
+
+        def store(item):
+            if "spool" in item:
+                with item.pop("spool") as spool:
+                    name = f"{item['pid']}.xml"
+                    item["file"] = f"{archive.add(name, spool, item['size'])}/{name}"
+            return item
+
+        stages = [Stage(fetch, workers, "fetch")]
+        if archive is not None:
+            stages.append(Stage(store, 1, "archive"))
+        pipeline = Pipeline(stages, queue_size=self.settings.get("queue_size", 64))
+        try:
+            outputs = pipeline.run(self.results, len(self.results))
+        finally:
+            if archive is not None:
+                archive.close()
+        order = {result: position for position, result in enumerate(self.results)}
+        outputs.sort(key=lambda output: order[output["pid"]])
+        errors = [(output["pid"], output["error"]) for output in outputs if "error" in output]
+        errors += [(item["pid"] if type(item) is dict else item, repr(error)) for item, error in pipeline.errors]
+        successes = [output for output in outputs if "error" not in output]
+        manifest = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "compression": compression or "none",
+                    "objects": {output["pid"]: {key: value for key, value in output.items() if key != "pid"}
+                                for output in successes}}
+        if archive is not None:
+            manifest["archives"] = {name: os.path.getsize(os.path.join(directory, name)) for name in archive.archives}
+        with open(os.path.join(directory, "foxml_manifest.json"), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        return {"PIDs processed": self.results, "FOXML files": [output["file"] for output in successes],
+                "errors": errors, "destination_directory": directory,
+                "manifest": os.path.join(directory, "foxml_manifest.json")}
 
     def test_embargos(self):
         for result in self.results:
@@ -588,6 +1405,82 @@ class Set:
             new_record.am_i_embargoed()
         return
 
+    def audit_embargoes(self, report_file="embargo_report.csv"):
+        """Finds every object and datastream embargo in a result set and groups them by when they expire.
+
+        RELS-EXT (object embargoes) and RELS-INT (datastream embargoes) are read max_workers at a time.  Each
+        embargo-until date is put in the first of embargo_windows (days from today) it expires within; embargoes that
+        have passed are expired, and ones without a date are indefinite.
+
+        Args:
+            report_file (str): A csv file to write each embargo to, with its PID, dsid, date and window.
+
+        Returns:
+            dict: A dict with the number of PIDs checked, the number of embargoes, the embargoes in each window as
+            dicts with the PID, dsid (None for the whole object) and embargo-until value, a list of errors as tuples
+            with the PID and the http status code or exception, and the report file.
+
+        Examples:
+            >>> Set('http://localhost:8080', yaml.safe_load(open("config.yml", "r"))).audit_embargoes()
+            {'PIDs checked': 3, 'Embargoes': 1, 'windows': {'expired': [], 'within 30 days': [{'pid': 'test:4',
+            'dsid': 'OBJ', 'until': '2026-11-01T00:00:00Z'}], 'within 90 days': [], 'within 365 days': [],
+            'later': [], 'indefinite': []}, 'errors': [], 'report': 'embargo_report.csv'}
+
+        """
+        print("\n\nReading embargoes from RELS-EXT and RELS-INT.\n")
+        with ThreadPoolExecutor(self.settings.get("max_workers", 8)) as executor:
+            details = list(tqdm(executor.map(self._embargo_details, self.results), total=len(self.results)))
+        windows = self.settings.get("embargo_windows", [30, 90, 365])
+        grouped = {"expired": []}
+        for days in windows:
+            grouped[f"within {days} days"] = []
+        grouped["later"] = []
+        grouped["indefinite"] = []
+        errors = []
+        today = datetime.date.today()
+        total = 0
+        with open(report_file, "w", newline="") as report:
+            writer = csv.writer(report)
+            writer.writerow(["pid", "dsid", "embargo_until", "window"])
+            for pid, detail in zip(self.results, details):
+                errors += [(pid, error) for error in detail["errors"]]
+                for embargo in detail["embargoes"]:
+                    try:
+                        until = datetime.datetime.strptime(embargo["until"][:10], "%Y-%m-%d").date()
+                    except ValueError:
+                        window = "indefinite"
+                    else:
+                        remaining = (until - today).days
+                        window = "expired" if remaining < 0 else \
+                            next((f"within {days} days" for days in windows if remaining <= days), "later")
+                    grouped[window].append(embargo)
+                    writer.writerow([embargo["pid"], embargo["dsid"] or "", embargo["until"], window])
+                    total += 1
+        return {"PIDs checked": len(self.results), "Embargoes": total, "windows": grouped, "errors": errors,
+                "report": report_file}
+
+    def _embargo_details(self, pid):
+        detail = {"embargoes": [], "errors": []}
+        for dsid in ("RELS-EXT", "RELS-INT"):
+            try:
+                r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/"
+                               f"datastreams/{dsid}/content", self.settings,
+                               auth=(self.settings['username'], self.settings['password']))
+                if r.status_code == 404:
+                    continue
+                if r.status_code != 200:
+                    detail["errors"].append(r.status_code)
+                    continue
+                statements = list(rdf_statements(r.content))
+            except (requests.exceptions.RequestException, etree.XMLSyntaxError) as error:
+                detail["errors"].append(repr(error))
+                continue
+            for subject, predicate, value in statements:
+                if predicate == f"{EMBARGO}embargo-until":
+                    detail["embargoes"].append({"pid": pid, "dsid": subject.split("/")[1] if "/" in subject else None,
+                                                "until": value})
+        return detail
+
     def check_obj_mime_types(self):
         mime_types = {}
         for result in tqdm(self.results):
@@ -640,9 +1533,9 @@ class Record:
     def find_islandora_relationship(self, relationship):
         predicate = "&predicate=http://islandora.ca/ontology/relsext#" \
                     f"{relationship}".replace(":", "%3a").replace("/", "%2f").replace("#", "%23")
-        r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/"
-                         f"{self.pid}/relationships?subject=info%3afedora%2f{self.pid}&format=turtle{predicate}",
-                         auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/"
+                       f"{self.pid}/relationships?subject=info%3afedora%2f{self.pid}&format=turtle{predicate}",
+                       self.settings, auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
         if r.status_code == 200:
             new_list = r.text.split(' ')
             if len(new_list) is 4:
@@ -680,9 +1573,9 @@ class Record:
     def find_rels_ext_relationship(self, relationship):
         predicate = "&predicate=info:fedora/fedora-system:def/relations-external#" \
                     f"{relationship}".replace(":", "%3a").replace("/", "%2f").replace("#", "%23")
-        r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/"
-                         f"{self.pid}/relationships?subject=info%3afedora%2f{self.pid}&format=turtle{predicate}",
-                         auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/"
+                       f"{self.pid}/relationships?subject=info%3afedora%2f{self.pid}&format=turtle{predicate}",
+                       self.settings, auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
         if r.status_code == 200:
             new_list = r.text.split(">")
             if len(new_list) == 4:
@@ -694,8 +1587,9 @@ class Record:
         return
 
     def get_parent_label(self, xpath):
-        mods = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{self.pid}/"
-                            f"datastreams/MODS/content", auth=(self.settings['username'], self.settings['password']))
+        mods = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{self.pid}/"
+                          f"datastreams/MODS/content", self.settings,
+                          auth=(self.settings['username'], self.settings['password']))
         document = etree.fromstring(mods.content)
         label_path = document.xpath(xpath, namespaces={"mods": "http://www.loc.gov/mods/v3"})
         return label_path[0].text
@@ -720,8 +1614,9 @@ class Record:
         return status
 
     def am_i_embargoed(self):
-        r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{self.pid}/"
-                         f"datastreams/RELS-INT", auth=(self.settings['username'], self.settings['password']))
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{self.pid}/"
+                       f"datastreams/RELS-INT", self.settings,
+                       auth=(self.settings['username'], self.settings['password']))
         if r.status_code != 404:
             print(f"{self.pid}:  {r.status_code}")
         else:
@@ -776,9 +1671,9 @@ class Record:
         content_type = ""
         predicate = "&predicate=info:fedora/fedora-system:def/model#" \
                     "hasModel".replace(":", "%3a").replace("/", "%2f").replace("#", "%23")
-        r = requests.get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/"
-                         f"{self.pid}/relationships?subject=info%3afedora%2f{self.pid}&format=turtle{predicate}",
-                         auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/"
+                       f"{self.pid}/relationships?subject=info%3afedora%2f{self.pid}&format=turtle{predicate}",
+                       self.settings, auth=(f"{self.settings['username']}", f"{self.settings['password']}"))
         for result in r.text.split(" "):
             if result.startswith("<info:fedora/islandora:"):
                 content_type = result.replace("<info:fedora/islandora:", "").replace(">", "")
@@ -0,0 +1,39 @@
+from io import BytesIO
+
+
+COLORSPACES = {"sRGB": "RGB", "RGB": "RGB", "Gray": "L", "L": "L", "CMYK": "CMYK"}
+
+
+def transform_image(data, image_format=None, max_dimension=None, colorspace=None):
+    """Converts, shrinks or changes the colorspace of an image.
+
+    This runs in a worker process, so it only takes and returns bytes and strings.
+
+    Args:
+        data (bytes): The image as downloaded.
+        image_format (str): The format to save as, like png or jpeg.  Defaults to the format of the image.
+        max_dimension (int): The longest the width or height can be.  Smaller images aren't enlarged.
+        colorspace (str): sRGB, Gray or CMYK, like convert.py, or a Pillow mode.
+
+    Returns:
+        tuple: The new image as bytes and its file extension.
+
+    Examples:
+        >>> transform_image(open("test_4.jpeg", "rb").read(), "png", 200, "Gray")
+        (b'\\x89PNG...', 'png')
+
+    """
+    from PIL import Image
+    in_file = Image.open(BytesIO(data))
+    image_format = (image_format or in_file.format).lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if max_dimension is not None:
+        in_file.thumbnail((int(max_dimension), int(max_dimension)))
+    if colorspace is not None:
+        in_file = in_file.convert(COLORSPACES.get(colorspace, colorspace))
+    if image_format == "jpeg" and in_file.mode not in ("RGB", "L", "CMYK"):
+        in_file = in_file.convert("RGB")
+    out_file = BytesIO()
+    in_file.save(out_file, format=image_format)
+    return out_file.getvalue(), image_format
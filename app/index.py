@@ -0,0 +1,488 @@
+from lxml import etree
+import sqlite3
+import os
+import base64
+import tarfile
+from tqdm import tqdm
+from app.verify import verify_directory, mime_extension
+from app.archive import open_compressed, read_archive
+
+
+FOXML = "info:fedora/fedora-system:def/foxml#"
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+DC = "http://purl.org/dc/elements/1.1/"
+MODS = "http://www.loc.gov/mods/v3"
+RELS_EXT = "info:fedora/fedora-system:def/relations-external#"
+ISLANDORA = "http://islandora.ca/ontology/relsext#"
+MODEL = "info:fedora/fedora-system:def/model#"
+VIEW = "info:fedora/fedora-system:def/view#"
+EMBARGO = "info:islandora/islandora-system:def/scholar#"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (pid TEXT PRIMARY KEY, label TEXT, state TEXT, owner_id TEXT, created TEXT,
+                                    modified TEXT, source TEXT);
+CREATE TABLE IF NOT EXISTS datastreams (pid TEXT, dsid TEXT, state TEXT, control_group TEXT, version_id TEXT,
+                                        created TEXT, mimetype TEXT, size INTEGER, checksum_type TEXT, checksum TEXT,
+                                        latest INTEGER, PRIMARY KEY (pid, version_id));
+CREATE TABLE IF NOT EXISTS relationships (pid TEXT, predicate TEXT, object TEXT);
+CREATE TABLE IF NOT EXISTS dc (pid TEXT, field TEXT, value TEXT);
+CREATE TABLE IF NOT EXISTS content (pid TEXT, dsid TEXT, xml BLOB, PRIMARY KEY (pid, dsid));
+CREATE INDEX IF NOT EXISTS datastreams_dsid ON datastreams (dsid, latest);
+CREATE INDEX IF NOT EXISTS relationships_pid ON relationships (pid, predicate);
+CREATE INDEX IF NOT EXISTS relationships_predicate ON relationships (predicate, object);
+CREATE INDEX IF NOT EXISTS dc_field ON dc (field, value);
+"""
+
+OBJECT_PROPERTIES = {
+    f"{MODEL}label": "label",
+    f"{MODEL}state": "state",
+    f"{MODEL}ownerId": "owner_id",
+    f"{MODEL}createdDate": "created",
+    f"{VIEW}lastModifiedDate": "modified",
+}
+
+OBJECT_STATES = {"Active": "A", "Inactive": "I", "Deleted": "D"}
+
+
+def rdf_triples(content):
+    """Yields the predicates and objects of every statement in a RELS-EXT or relationships RDF/XML document.
+
+    Args:
+        content (bytes): The RDF/XML to parse.
+
+    Returns:
+        generator: Tuples of the full predicate URI and the object with any info:fedora/ prefix removed.
+
+    """
+    for subject, predicate, value in rdf_statements(content):
+        yield predicate, value
+
+
+def rdf_statements(content):
+    """Yields every statement in a RELS-EXT, RELS-INT or relationships RDF/XML document.
+
+    Args:
+        content (bytes): The RDF/XML to parse.
+
+    Returns:
+        generator: Tuples of the subject and object with any info:fedora/ prefix removed, and the full predicate URI.
+
+    """
+    document = etree.fromstring(content)
+    for description in document.iter(f"{{{RDF}}}Description"):
+        subject = description.get(f"{{{RDF}}}about", "").replace("info:fedora/", "")
+        for statement in description:
+            if not isinstance(statement.tag, str):
+                continue
+            predicate = statement.tag.replace("{", "").replace("}", "")
+            value = statement.get(f"{{{RDF}}}resource", statement.text)
+            if value is not None:
+                yield subject, predicate, value.replace("info:fedora/", "")
+
+
+class FoxmlIndex:
+    def __init__(self, path, inline_dsids=("MODS",)):
+        """Opens (or creates) a SQLite index of a FOXML snapshot.
+
+        Object states are stored as A, I or D, the way the REST API reports them, rather than the Active, Inactive
+        and Deleted in FOXML.  Indexes built with the long names are converted when they're opened.
+
+        Args:
+            path (str): The path to the SQLite database.
+            inline_dsids (tuple): Datastream ids whose newest inline content should be kept in the index so that
+                queries like find_pages_per_book can run offline.
+
+        """
+        self.path = path
+        self.inline_dsids = inline_dsids
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        for state, code in OBJECT_STATES.items():
+            self.connection.execute("UPDATE objects SET state = ? WHERE state = ?", (code, state))
+        self.connection.commit()
+
+    def __repr__(self):
+        return f"FOXML snapshot index stored at {self.path}."
+
+    def __str__(self):
+        return f"FOXML snapshot index stored at {self.path}."
+
+    def build(self, directory):
+        """Ingests every FOXML file in a directory into the index.
+
+        Files are streamed with iterparse and cleared as they are read, so objects with large inline datastreams are
+        never held in memory at once.  Compressed exports (.xml.gz and .xml.zst) and the rolling archives written by
+        grab_foxml are read as they are.  Objects that are already indexed are replaced.  Other XML in the directory,
+        like harvested MODS or export_snapshot output, is skipped as soon as its root element turns out not to be
+        foxml:digitalObject.
+
+        Args:
+            directory (str): The directory that grab_foxml serialized to.
+
+        Returns:
+            dict: A dict with the number of FOXML files found, the number of objects indexed, the number of other XML
+            files skipped, and a list of errors as tuples with the file name and the parser error.
+
+        Examples:
+            >>> FoxmlIndex("foxml_index.db").build("output")
+            {'FOXML files': 3, 'Objects indexed': 3, 'Skipped': 0, 'errors': []}
+
+        """
+        files = [os.path.join(path, name) for path, folders, names in os.walk(directory) for name in names
+                 if name.endswith((".xml", ".xml.gz", ".xml.zst", ".tar", ".tar.gz", ".tar.zst"))]
+        errors = []
+        indexed = 0
+        found = 0
+        skipped = 0
+        for foxml_file in tqdm(files):
+            if ".tar" in os.path.basename(foxml_file):
+                members = ((f"{foxml_file}/{name}", member) for name, member in read_archive(foxml_file))
+            else:
+                members = [(foxml_file, None)]
+            try:
+                for name, member in members:
+                    try:
+                        if member is None:
+                            with open_compressed(foxml_file) as source:
+                                pid = self.add_object(source, name)
+                        else:
+                            pid = self.add_object(member, name)
+                        if pid is None:
+                            skipped += 1
+                            continue
+                        found += 1
+                        indexed += 1
+                    except (etree.XMLSyntaxError, ValueError) as error:
+                        found += 1
+                        errors.append((name, str(error)))
+            except (OSError, tarfile.TarError, ImportError) as error:
+                errors.append((foxml_file, str(error)))
+        self.connection.commit()
+        return {"FOXML files": found, "Objects indexed": indexed, "Skipped": skipped, "errors": errors}
+
+    def add_object(self, source, name=None):
+        """Parses a single FOXML file and writes its object, datastream, RELS-EXT, DC and inline rows to the index.
+
+        Args:
+            source (str or file): A path or file object containing one FOXML export.
+            name (str): What to record as the source of the object.  Defaults to source.
+
+        Returns:
+            str: The PID of the object that was indexed, or None if source isn't FOXML.
+
+        """
+        pid = None
+        root = None
+        properties = {}
+        versions = []
+        newest = {}
+        for event, element in etree.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element.tag
+                    if root != f"{{{FOXML}}}digitalObject":
+                        return None
+                if element.tag == f"{{{FOXML}}}digitalObject":
+                    pid = element.get("PID")
+                continue
+            if element.tag == f"{{{FOXML}}}property":
+                if element.get("NAME") in OBJECT_PROPERTIES:
+                    properties[OBJECT_PROPERTIES[element.get("NAME")]] = element.get("VALUE")
+            elif element.tag == f"{{{FOXML}}}datastreamVersion":
+                datastream = element.getparent()
+                dsid = datastream.get("ID")
+                digest = element.find(f"{{{FOXML}}}contentDigest")
+                size = element.get("SIZE")
+                versions.append({"dsid": dsid, "state": datastream.get("STATE"),
+                                 "control_group": datastream.get("CONTROL_GROUP"), "version_id": element.get("ID"),
+                                 "created": element.get("CREATED", ""), "mimetype": element.get("MIMETYPE"),
+                                 "size": int(size) if size else None,
+                                 "checksum_type": digest.get("TYPE") if digest is not None else None,
+                                 "checksum": digest.get("DIGEST") if digest is not None else None})
+                if dsid in ("RELS-EXT", "DC") + tuple(self.inline_dsids):
+                    if dsid not in newest or newest[dsid][0] <= element.get("CREATED", ""):
+                        newest[dsid] = (element.get("CREATED", ""), self._inline_content(element))
+                element.clear()
+            elif element.tag == f"{{{FOXML}}}datastream":
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        if pid is None:
+            raise ValueError(f"No digitalObject PID found in {source}.")
+        self._replace_object(pid, properties, versions, newest, str(source) if name is None else name)
+        return pid
+
+    @staticmethod
+    def _inline_content(version):
+        xml_content = version.find(f"{{{FOXML}}}xmlContent")
+        if xml_content is not None and len(xml_content) > 0:
+            return etree.tostring(xml_content[0])
+        binary_content = version.find(f"{{{FOXML}}}binaryContent")
+        if binary_content is not None and binary_content.text:
+            return base64.b64decode("".join(binary_content.text.split()))
+        return None
+
+    def _replace_object(self, pid, properties, versions, newest, source):
+        cursor = self.connection.cursor()
+        for table in ("objects", "datastreams", "relationships", "dc", "content"):
+            cursor.execute(f"DELETE FROM {table} WHERE pid = ?", (pid,))
+        cursor.execute("INSERT INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (pid, properties.get("label"), OBJECT_STATES.get(properties.get("state"), properties.get("state")),
+                        properties.get("owner_id"),
+                        properties.get("created"), properties.get("modified"), source))
+        latest = {}
+        for version in versions:
+            if version["dsid"] not in latest or latest[version["dsid"]] <= version["created"]:
+                latest[version["dsid"]] = version["created"]
+        cursor.executemany("INSERT OR REPLACE INTO datastreams VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(pid, v["dsid"], v["state"], v["control_group"], v["version_id"], v["created"],
+                             v["mimetype"], v["size"], v["checksum_type"], v["checksum"],
+                             int(latest[v["dsid"]] == v["created"])) for v in versions])
+        for dsid, (created, content) in newest.items():
+            if content is None:
+                continue
+            if dsid == "RELS-EXT":
+                cursor.executemany("INSERT INTO relationships VALUES (?, ?, ?)",
+                                   [(pid, predicate, value) for predicate, value in rdf_triples(content)])
+            elif dsid == "DC":
+                document = etree.fromstring(content)
+                cursor.executemany("INSERT INTO dc VALUES (?, ?, ?)",
+                                   [(pid, etree.QName(field).localname, field.text) for field in document.iter()
+                                    if isinstance(field.tag, str) and field.tag.startswith(f"{{{DC}}}")])
+            if dsid in self.inline_dsids:
+                cursor.execute("INSERT OR REPLACE INTO content VALUES (?, ?, ?)", (pid, dsid, content))
+
+    def find_pids(self, namespace=None, dc_field=None, dc_string=None):
+        """Returns the PIDs in the index that match a run.py style query.
+
+        Args:
+            namespace (str): A PID prefix, like the -p argument of run.py.
+            dc_field (str): A Dublin Core field to match on, like -dc.
+            dc_string (str): The value to match, like -dcs.  * and ? are treated as wildcards.
+
+        Returns:
+            list: The matching PIDs sorted.
+
+        Examples:
+            >>> FoxmlIndex("foxml_index.db").find_pids("test")
+            ['test:4', 'test:5', 'test:6']
+
+        """
+        query = "SELECT pid FROM objects WHERE 1 = 1"
+        parameters = []
+        if namespace:
+            query += " AND pid LIKE ?"
+            parameters.append(f"{namespace}%")
+        if dc_field and dc_string:
+            query += " AND pid IN (SELECT pid FROM dc WHERE field = ? AND value LIKE ?)"
+            parameters += [dc_field, dc_string.replace("*", "%").replace("?", "_")]
+        return [row[0] for row in self.connection.execute(f"{query} ORDER BY pid", parameters)]
+
+
+class OfflineSet:
+    def __init__(self, index, pids, yaml_settings):
+        """Initializes a Set-like view over a FoxmlIndex so operations run as local queries.
+
+        Only the operations that can be answered from FOXML are implemented; their return values match the Set methods
+        with the same name so run.py can print them unchanged.
+
+        Args:
+            index (FoxmlIndex): The index to query.
+            pids (list): The PIDs in this result set.
+            yaml_settings (dict): A dict of various setting predefined by the user in a config file.
+
+        """
+        self.index = index
+        self.results = list(pids)
+        self.size = len(self.results)
+        self.settings = yaml_settings
+        self.token = None
+        self.index.connection.execute("CREATE TEMP TABLE IF NOT EXISTS result_set (pid TEXT PRIMARY KEY)")
+        self.index.connection.execute("DELETE FROM result_set")
+        self.index.connection.executemany("INSERT OR IGNORE INTO result_set VALUES (?)",
+                                          [(pid,) for pid in self.results])
+
+    def __repr__(self):
+        return f"An offline set of {self.size} records from {self.index.path}."
+
+    def __str__(self):
+        return f"An offline set of {self.size} records from {self.index.path}."
+
+    def count_objects(self):
+        return len(self.results)
+
+    def write_results_to_file(self):
+        with open("results.txt", 'w') as my_results:
+            print("\nWriting results to results.txt.\n")
+            for result in self.results:
+                my_results.write(f"{result}\n")
+            print("Done")
+        return
+
+    def list_dsids(self):
+        """Lists all dsids in a result set.
+
+        Returns:
+            dict: The same dict as Set.list_dsids().
+
+        """
+        unique_dsids = [row[0] for row in self.index.connection.execute(
+            "SELECT DISTINCT dsid FROM datastreams WHERE latest = 1 AND pid IN result_set")]
+        return {"PIDs checked": self.results, "Total checked": len(self.results), "Unique dsids": unique_dsids,
+                "Errors": [], "Total errors": 0, "Total dsids": len(unique_dsids)}
+
+    def get_datastream_report(self):
+        """Returns a report on each datastream in a query.
+
+        Returns:
+            dict: The same dict as Set.get_datastream_report().
+
+        """
+        unique_datastreams = {}
+        for dsid, pid in self.index.connection.execute(
+                "SELECT dsid, pid FROM datastreams WHERE latest = 1 AND pid IN result_set ORDER BY pid"):
+            if dsid not in unique_datastreams:
+                unique_datastreams[dsid] = {'count': 1, 'pids': [pid]}
+            else:
+                unique_datastreams[dsid]['count'] += 1
+                unique_datastreams[dsid]['pids'].append(pid)
+        return unique_datastreams
+
+    def find_objects_missing_datastream(self, dsid):
+        """Find PIDs without a certain dsid.
+
+        Args:
+            dsid (str): A datastream id.
+
+        Returns:
+            dict: The same dict as Set.find_objects_missing_datastream().
+
+        """
+        missing = [row[0] for row in self.index.connection.execute(
+            "SELECT pid FROM result_set WHERE pid NOT IN (SELECT pid FROM datastreams WHERE dsid = ?) ORDER BY pid",
+            (dsid,))]
+        return {"PIDs Checked": self.results, "dsid": dsid, "PIDs missing dsid": missing,
+                "Total checked": len(self.results), "Total missing dsid:": len(missing)}
+
+    def check_obj_mime_types(self):
+        """Counts the mime types of the newest OBJ datastream in a result set.
+
+        Returns:
+            dict: The same dict as Set.check_obj_mime_types().
+
+        """
+        return {mimetype: count for mimetype, count in self.index.connection.execute(
+            "SELECT mimetype, COUNT(*) FROM datastreams WHERE dsid = 'OBJ' AND latest = 1 AND pid IN result_set "
+            "GROUP BY mimetype")}
+
+    def find_rels_ext_relationship(self, relationship):
+        """Finds objects with a RELS-EXT relationship and their page numbers.
+
+        Args:
+            relationship (str): A relations-external predicate like isMemberOf.
+
+        Returns:
+            list: The same list of dicts as Set.find_rels_ext_relationship().
+
+        """
+        rows = self.index.connection.execute(
+            "SELECT r.pid, r.object, p.object FROM relationships r LEFT JOIN relationships p ON p.pid = r.pid AND "
+            "p.predicate = ? WHERE r.predicate = ? AND r.pid IN result_set ORDER BY r.pid",
+            (f"{ISLANDORA}isPageNumber", f"{RELS_EXT}{relationship}"))
+        return [{"pid": pid, f"{relationship}": parent, "page number": page_number}
+                for pid, parent, page_number in rows]
+
+    def find_content_types(self):
+        content_types = []
+        for row in self.index.connection.execute(
+                "SELECT DISTINCT object FROM relationships WHERE predicate = ? AND pid IN result_set",
+                (f"{MODEL}hasModel",)):
+            if row[0].startswith("islandora:"):
+                content_types.append(row[0].replace("islandora:", ""))
+        return content_types
+
+    def verify_files(self, dsid, directory=None):
+        """Checks downloaded files against the sizes and checksums recorded in the FOXML.
+
+        Args:
+            dsid (str): The datastream id the files were downloaded from.
+            directory (str): Where the files are.  Defaults to destination_directory.
+
+        Returns:
+            dict: The same dict as Set.verify_files().
+
+        """
+        if directory is None:
+            directory = self.settings["destination_directory"]
+        expected = {}
+        for pid, mimetype, size, checksum_type, checksum in self.index.connection.execute(
+                "SELECT pid, mimetype, size, checksum_type, checksum FROM datastreams "
+                "WHERE dsid = ? AND latest = 1 AND pid IN result_set", (dsid,)):
+            expected[f"{pid.replace(':', '_')}.{mime_extension(mimetype)}"] = {
+                "pid": pid, "size": size, "checksum_type": checksum_type, "checksum": checksum}
+        report = verify_directory(expected, directory, self.settings.get("hash_workers"))
+        report["errors"] = []
+        return report
+
+    def index_solr(self, indexer):
+        """Posts a Solr document for each object in a result set, built from the index.
+
+        Only MODS stored in the index (see inline_dsids) can be used by mods: fields.
+
+        Args:
+            indexer (SolrIndexer): Builds the documents and posts them.
+
+        Returns:
+            dict: The same dict as Set.index_solr().
+
+        """
+        dc = {}
+        for pid, field, value in self.index.connection.execute(
+                "SELECT pid, field, value FROM dc WHERE pid IN result_set ORDER BY rowid"):
+            if value:
+                dc.setdefault(pid, {}).setdefault(field, []).append(value.strip())
+        mods = {}
+        if indexer.needs_mods():
+            mods = dict(self.index.connection.execute(
+                "SELECT pid, xml FROM content WHERE dsid = 'MODS' AND pid IN result_set"))
+        for pid, label, state, owner_id, created, modified in tqdm(self.index.connection.execute(
+                "SELECT pid, label, state, owner_id, created, modified FROM objects WHERE pid IN result_set "
+                "ORDER BY pid").fetchall()):
+            properties = {"label": label, "state": state, "owner_id": owner_id, "created": created,
+                          "modified": modified}
+            indexer.add(pid, indexer.document(pid, properties, dc.get(pid), mods.get(pid)))
+        report = indexer.finish()
+        report["PIDs attempted"] = len(self.results)
+        return report
+
+    def get_parent_label(self, pid, xpath):
+        row = self.index.connection.execute("SELECT xml FROM content WHERE pid = ? AND dsid = 'MODS'",
+                                            (pid,)).fetchone()
+        if row is None:
+            raise IndexError(f"No MODS for {pid} in index.")
+        document = etree.fromstring(row[0])
+        return document.xpath(xpath, namespaces={"mods": MODS})[0].text
+
+    def find_pages_per_book(self):
+        """Counts the pages of each book in a result set from the index.
+
+        Returns:
+            list: The same list of dicts as Set.find_pages_per_book().
+
+        """
+        book_list = {}
+        for membership in self.find_rels_ext_relationship("isMemberOf"):
+            parent = membership["isMemberOf"]
+            if parent not in book_list:
+                try:
+                    label = self.get_parent_label(parent, "//mods:identifier[@type='local']")
+                except IndexError:
+                    label = "missing"
+                try:
+                    extent = self.get_parent_label(parent, "//mods:extent")
+                except IndexError:
+                    extent = "missing"
+                book_list[parent] = {"name": parent, "pages": 1, "admindb": label, "extent_pages": extent}
+            else:
+                book_list[parent]["pages"] += 1
+        return list(book_list.values())
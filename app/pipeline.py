@@ -0,0 +1,223 @@
+import threading
+import queue
+import time
+import os
+from tqdm import tqdm
+
+
+DONE = object()
+
+
+class Stage:
+    def __init__(self, function, workers=1, name="stage"):
+        """A step of a Pipeline run by its own pool of threads.
+
+        Args:
+            function (function): Called with each item from the previous stage.  Its return value is passed to the
+                next stage; None drops the item and a list passes each element on separately.
+            workers (int): The number of threads running function.
+            name (str): A name used for the threads.
+
+        """
+        self.function = function
+        self.workers = workers
+        self.name = name
+
+    def __repr__(self):
+        return f"Pipeline stage {self.name} with {self.workers} workers."
+
+    def __str__(self):
+        return f"Pipeline stage {self.name} with {self.workers} workers."
+
+
+class WriteBehindWriter:
+    def __init__(self, batch_size=64, fsync=True, flush_interval=0.5):
+        """The last step of a Pipeline, writing files in batches on its own thread.
+
+        Items are dicts.  Those with a path and data are written to disk and passed on without their data; everything
+        else is passed on untouched.  A batch is written when batch_size items are waiting or flush_interval seconds
+        have passed, and when fsync is set every file in the batch is synced before any is closed, so the disk sees
+        a few large flushes instead of one per object.
+
+        Args:
+            batch_size (int): The most files to write at once.
+            fsync (bool): Sync each batch to disk before reporting it written.
+            flush_interval (float): The longest an item waits for its batch to fill.
+
+        """
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.flush_interval = flush_interval
+
+    def __repr__(self):
+        return f"Write-behind writer with batches of {self.batch_size}."
+
+    def __str__(self):
+        return f"Write-behind writer with batches of {self.batch_size}."
+
+    def write_batch(self, batch):
+        """Writes every item in batch that has a path, then syncs and closes them together.
+
+        An item whose file can't be opened, written or synced gets an error with the exception instead, and its
+        partly written file is removed.
+
+        """
+        files = []
+        try:
+            for item in batch:
+                if "path" not in item:
+                    continue
+                try:
+                    new_file = open(item["path"], "wb")
+                except Exception as error:
+                    item.pop("data", None)
+                    item["error"] = repr(error)
+                    continue
+                files.append((item, new_file))
+                try:
+                    new_file.write(item.pop("data"))
+                except Exception as error:
+                    item["error"] = repr(error)
+            for item, new_file in files:
+                if self.fsync and "error" not in item:
+                    try:
+                        new_file.flush()
+                        os.fsync(new_file.fileno())
+                    except Exception as error:
+                        item["error"] = repr(error)
+        finally:
+            for item, new_file in files:
+                try:
+                    new_file.close()
+                except Exception as error:
+                    item.setdefault("error", repr(error))
+                if "error" in item and os.path.exists(item["path"]):
+                    os.remove(item["path"])
+        for item in batch:
+            if "error" in item:
+                item.pop("path", None)
+                item.pop("file", None)
+        return batch
+
+    def run(self, inbox, outbox):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while True:
+                try:
+                    item = inbox.get(timeout=max(deadline - time.monotonic(), 0.01))
+                except queue.Empty:
+                    item = None
+                if item is DONE or item is None or len(batch) + 1 >= self.batch_size:
+                    if item is not None and item is not DONE:
+                        batch.append(item)
+                    for written in self.write_batch(batch):
+                        outbox.put(written)
+                    batch = []
+                    deadline = time.monotonic() + self.flush_interval
+                    if item is DONE:
+                        return
+                else:
+                    batch.append(item)
+        finally:
+            outbox.put(DONE)
+
+
+class Pipeline:
+    def __init__(self, stages, writer=None, queue_size=64):
+        """Connects stages with bounded queues so each runs at its own speed with bounded memory.
+
+        Args:
+            stages (list): Stages to run in order.
+            writer (WriteBehindWriter): An optional writer that receives the output of the last stage.
+            queue_size (int): The most items waiting between two stages.
+
+        Examples:
+            >>> Pipeline([Stage(fetch, 8, "fetch"), Stage(transform, 2, "transform")], WriteBehindWriter()).run(pids)
+            [{'pid': 'test:4', 'path': 'output/test_4.xml'}, {'pid': 'test:5', 'error': 404}]
+
+        """
+        self.stages = stages
+        self.writer = writer
+        self.queue_size = queue_size
+        self.errors = []
+
+    def __repr__(self):
+        return f"Pipeline of {' -> '.join(stage.name for stage in self.stages)}."
+
+    def __str__(self):
+        return f"Pipeline of {' -> '.join(stage.name for stage in self.stages)}."
+
+    def run(self, items, total=None):
+        """Feeds items through every stage and returns what comes out of the end.
+
+        Args:
+            items (iterable): The items for the first stage.
+            total (int): The number of outputs expected, for the progress bar.
+
+        Returns:
+            list: The outputs of the last stage (or writer), in the order they finished.  Exceptions raised by a stage
+            are kept in the errors property as tuples with the item and the exception.
+
+        """
+        queues = [queue.Queue(self.queue_size) for stage in self.stages]
+        outbox = queue.Queue(self.queue_size)
+        writer_inbox = queue.Queue(self.queue_size) if self.writer is not None else outbox
+        threads = []
+        for position, stage in enumerate(self.stages):
+            inbox = queues[position]
+            following = queues[position + 1] if position + 1 < len(self.stages) else writer_inbox
+            following_workers = self.stages[position + 1].workers if position + 1 < len(self.stages) else 1
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for number in range(stage.workers):
+                threads.append(threading.Thread(target=self._work,
+                                                args=(stage, inbox, following, following_workers, remaining, lock),
+                                                name=f"{stage.name}-{number}", daemon=True))
+        if self.writer is not None:
+            threads.append(threading.Thread(target=self.writer.run, args=(writer_inbox, outbox), name="writer",
+                                            daemon=True))
+        threads.append(threading.Thread(target=self._feed, args=(items, queues[0], self.stages[0].workers),
+                                        name="feed", daemon=True))
+        for thread in threads:
+            thread.start()
+        outputs = []
+        with tqdm(total=total) as progress:
+            while True:
+                output = outbox.get()
+                if output is DONE:
+                    break
+                outputs.append(output)
+                progress.update(1)
+        for thread in threads:
+            thread.join()
+        return outputs
+
+    @staticmethod
+    def _feed(items, inbox, workers):
+        for item in items:
+            inbox.put(item)
+        for number in range(workers):
+            inbox.put(DONE)
+        return
+
+    def _work(self, stage, inbox, following, following_workers, remaining, lock):
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    for number in range(following_workers):
+                        following.put(DONE)
+                return
+            try:
+                output = stage.function(item)
+            except Exception as error:
+                self.errors.append((item, error))
+                continue
+            if output is None:
+                continue
+            for result in output if type(output) is list else [output]:
+                following.put(result)
@@ -0,0 +1,144 @@
+import xmltodict
+from tqdm import tqdm
+from app.cache import cached_get
+from app.index import rdf_triples, RELS_EXT, ISLANDORA, MODEL
+
+
+FUSABLE_OPERATIONS = {
+    "count_objects": (),
+    "list_dsids": ("datastreams",),
+    "get_datastream_report": ("datastreams",),
+    "find_missing": ("datastreams",),
+    "test_obj_mimes": ("datastreams",),
+    "find_content_type": ("relationships",),
+    "find_matching_relationship": ("relationships",),
+    "find_bad_books": ("datastreams", "relationships"),
+}
+
+
+class SinglePass:
+    def __init__(self, instance, operations, dsid, relationship=None):
+        """Plans one pass over a Set that gathers the per-object data every fusable operation needs.
+
+        After run() the instance answers the same methods as Set (list_dsids, get_datastream_report,
+        find_objects_missing_datastream, check_obj_mime_types, find_content_types, find_rels_ext_relationship) from
+        what was gathered, so run.py prints each report exactly as it would for a single operation.
+
+        Args:
+            instance (Set): A populated Set.
+            operations (list): The run.py operations to fuse.
+            dsid (str): The datastream id used by find_missing and find_bad_books.
+            relationship (str): The RELS-EXT predicate used by find_matching_relationship and find_bad_books.
+
+        """
+        self.instance = instance
+        self.results = instance.results
+        self.settings = instance.settings
+        self.operations = operations
+        self.dsid = dsid
+        self.predicates = set()
+        if "find_matching_relationship" in operations and relationship is not None:
+            self.predicates.add(relationship)
+        if "find_bad_books" in operations:
+            self.predicates.add(relationship if relationship is not None else "isMemberOf")
+        self.needs = {need for operation in operations for need in FUSABLE_OPERATIONS[operation]}
+        self.unique_datastreams = {}
+        self.missing = []
+        self.mime_types = {}
+        self.content_types = []
+        self.memberships = {predicate: [] for predicate in self.predicates}
+        self.errors = []
+
+    def __repr__(self):
+        return f"A single pass over {len(self.results)} records for {', '.join(self.operations)}."
+
+    def __str__(self):
+        return f"A single pass over {len(self.results)} records for {', '.join(self.operations)}."
+
+    def run(self):
+        """Requests each object's datastream listing and relationships at most once and feeds every operation.
+
+        Returns:
+            dict: A dict with the operations that were fused, the data that was requested per object, and the total
+            number of requests made.
+
+        """
+        print(f"\n\nRunning {', '.join(self.operations)} in one pass.\n")
+        requests_made = 0
+        for result in tqdm(self.results):
+            if "datastreams" in self.needs:
+                self._read_datastreams(result)
+                requests_made += 1
+            if "relationships" in self.needs:
+                self._read_relationships(result)
+                requests_made += 1
+        return {"Operations": self.operations, "Data requested": sorted(self.needs), "Total requests": requests_made}
+
+    def _read_datastreams(self, pid):
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/"
+                       f"datastreams?profiles=true", self.settings,
+                       auth=(self.settings["username"], self.settings["password"]))
+        if r.status_code != 200:
+            self.errors.append((pid, r.status_code))
+            return
+        profiles = xmltodict.parse(r.text)['objectDatastreams'].get('datastreamProfile', [])
+        if type(profiles) is not list:
+            profiles = [profiles]
+        dsids = []
+        for profile in profiles:
+            dsids.append(profile['@dsID'])
+            if profile['@dsID'] not in self.unique_datastreams:
+                self.unique_datastreams[profile['@dsID']] = {'count': 1, 'pids': [pid]}
+            else:
+                self.unique_datastreams[profile['@dsID']]['count'] += 1
+                self.unique_datastreams[profile['@dsID']]['pids'].append(pid)
+            if profile['@dsID'] == "OBJ":
+                self.mime_types[profile['dsMIME']] = self.mime_types.get(profile['dsMIME'], 0) + 1
+        if self.dsid not in dsids:
+            self.missing.append(pid)
+
+    def _read_relationships(self, pid):
+        r = cached_get(f"{self.settings['fedora_path']}:{self.settings['port']}/fedora/objects/{pid}/"
+                       f"relationships?subject=info%3afedora%2f{pid}", self.settings,
+                       auth=(self.settings["username"], self.settings["password"]))
+        if r.status_code != 200:
+            self.errors.append((pid, r.status_code))
+            return
+        triples = list(rdf_triples(r.content))
+        page_number = None
+        for predicate, value in triples:
+            if predicate == f"{MODEL}hasModel" and value.startswith("islandora:"):
+                if value.replace("islandora:", "") not in self.content_types:
+                    self.content_types.append(value.replace("islandora:", ""))
+            elif predicate == f"{ISLANDORA}isPageNumber":
+                page_number = value
+        for relationship in self.predicates:
+            for predicate, value in triples:
+                if predicate == f"{RELS_EXT}{relationship}":
+                    self.memberships[relationship].append({"pid": pid, f"{relationship}": value,
+                                                           "page number": page_number})
+                    break
+
+    def count_objects(self):
+        return len(self.results)
+
+    def list_dsids(self):
+        unique_dsids = list(self.unique_datastreams.keys())
+        return {"PIDs checked": self.results, "Total checked": len(self.results), "Unique dsids": unique_dsids,
+                "Errors": self.errors, "Total errors": len(self.errors), "Total dsids": len(unique_dsids)}
+
+    def get_datastream_report(self):
+        return self.unique_datastreams
+
+    def find_objects_missing_datastream(self, dsid):
+        return {"PIDs Checked": self.results, "dsid": dsid, "PIDs missing dsid": self.missing,
+                "Total checked": len(self.results), "Total missing dsid:": len(self.missing)}
+
+    def check_obj_mime_types(self):
+        return self.mime_types
+
+    def find_content_types(self):
+        return self.content_types
+
+    def find_rels_ext_relationship(self, relationship):
+        return self.memberships.get(relationship, [])
@@ -0,0 +1,183 @@
+import cProfile
+import pstats
+import threading
+import time
+import sys
+import os
+import re
+import io
+
+
+WHITEBREAD = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NETWORK = ("socket.py", "ssl.py", "selectors.py", f"http{os.sep}client.py", f"urllib3{os.sep}", "getaddrinfo")
+IDLE = ("threading.py:wait", "queue.py:get", "thread.py:_worker")
+PARSING = ("xmltodict", f"{os.sep}bs4{os.sep}", f"{os.sep}lxml{os.sep}", f"json{os.sep}", f"{os.sep}yaml{os.sep}")
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        """Samples the stacks of every thread at a fixed interval while an operation runs.
+
+        Sampling adds almost no overhead to the operation, and because threads blocked on a socket are sampled too,
+        time spent waiting on Fedora shows up as network wait rather than disappearing.
+
+        Args:
+            interval (float): Seconds between samples.
+
+        """
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def __repr__(self):
+        return f"Sampling profiler with {self.samples} samples."
+
+    def __str__(self):
+        return f"Sampling profiler with {self.samples} samples."
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, name="whitebread-profiler", daemon=True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        return
+
+    def _sample(self):
+        names = {}
+        while self.running:
+            for thread in threading.enumerate():
+                names[thread.ident] = re.sub(r"[_-]\d+(_\d+)?$", "", thread.name)
+            for ident, frame in sys._current_frames().items():
+                if ident == threading.get_ident():
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{self.module_name(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                collapsed = ";".join(reversed(stack))
+                self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+                self.samples += 1
+            time.sleep(self.interval)
+        return
+
+    @staticmethod
+    def module_name(filename):
+        if filename.startswith(WHITEBREAD) and "site-packages" not in filename:
+            return os.path.relpath(filename, WHITEBREAD)
+        return filename
+
+    def write_collapsed(self, path):
+        """Writes the samples as collapsed stacks for flamegraph.pl or speedscope.
+
+        Args:
+            path (str): The file to write, one "thread;frame;frame count" line per distinct stack.
+
+        """
+        with open(path, "w") as collapsed:
+            for stack, count in sorted(self.stacks.items()):
+                collapsed.write(f"{stack} {count}\n")
+        return
+
+    def summary(self, top=20):
+        """Attributes samples to whitebread functions, network wait and parsing.
+
+        Args:
+            top (int): How many functions to list.
+
+        Returns:
+            str: A text report.
+
+        """
+        whitebread = {}
+        leaves = {}
+        categories = {"network wait": 0, "parsing": 0, "idle or waiting on other threads": 0, "other": 0}
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if len(frames) == 0:
+                continue
+            leaves[frames[-1]] = leaves.get(frames[-1], 0) + count
+            for frame in set(frames):
+                if not frame.startswith(os.sep) and "site-packages" not in frame and ".py:" in frame \
+                        and not frame.startswith("<") and not frame.startswith(f"app{os.sep}profiler.py"):
+                    whitebread[frame] = whitebread.get(frame, 0) + count
+            if frames[-1].endswith(IDLE):
+                categories["idle or waiting on other threads"] += count
+            elif any(marker in frame for frame in frames[-4:] for marker in NETWORK):
+                categories["network wait"] += count
+            elif any(marker in frame for frame in frames[-4:] for marker in PARSING):
+                categories["parsing"] += count
+            else:
+                categories["other"] += count
+        total = max(self.samples, 1)
+        lines = [f"{self.samples} samples every {self.interval * 1000:.1f}ms across all threads.", ""]
+        for category, count in categories.items():
+            lines.append(f"{count / total:7.1%}  {category}")
+        lines += ["", f"Top {top} whitebread functions (inclusive):"]
+        for frame, count in sorted(whitebread.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(f"{count / total:7.1%}  {frame}")
+        lines += ["", f"Top {top} functions on top of the stack (self):"]
+        for frame, count in sorted(leaves.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(f"{count / total:7.1%}  {frame}")
+        return "\n".join(lines) + "\n"
+
+
+class ProfileSession:
+    def __init__(self, mode="sample", directory="profiles", name="profile", top=20, interval=0.005):
+        """Profiles everything run inside a with block and writes the results to directory.
+
+        The sample mode writes NAME.collapsed (flamegraph-ready) and NAME.txt.  The cprofile mode writes NAME.pstats
+        and NAME.txt with the functions sorted by cumulative time; it only sees the main thread, so use sample for
+        operations that run workers.
+
+        Args:
+            mode (str): sample or cprofile.
+            directory (str): Where to write the results.
+            name (str): The file name to use, without an extension.
+            top (int): How many functions to list in the text summary.
+            interval (float): Seconds between samples in sample mode.
+
+        """
+        self.mode = mode
+        self.directory = directory
+        self.name = name
+        self.top = top
+        self.profiler = SamplingProfiler(interval) if mode == "sample" else cProfile.Profile()
+
+    def __repr__(self):
+        return f"{self.mode} profile session writing to {self.directory}."
+
+    def __str__(self):
+        return f"{self.mode} profile session writing to {self.directory}."
+
+    def __enter__(self):
+        if self.mode == "sample":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, self.name)
+        if self.mode == "sample":
+            self.profiler.stop()
+            self.profiler.write_collapsed(f"{path}.collapsed")
+            report = self.profiler.summary(self.top)
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(f"{path}.pstats")
+            text = io.StringIO()
+            pstats.Stats(self.profiler, stream=text).sort_stats("cumulative").print_stats(self.top)
+            report = text.getvalue()
+        with open(f"{path}.txt", "w") as summary:
+            summary.write(report)
+        print(f"\n\nProfile written to {path}.*\n\n{report}")
+        return False
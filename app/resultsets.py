@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+
+
+class ResultStore:
+    def __init__(self, directory, ttl=3600):
+        """Opens a directory of saved result sets.
+
+        Each result set is a gzipped text file named for a hash of its findObjects query.  The first line is a JSON
+        header with the query, when it was saved and how many PIDs it holds; every other line is a PID.
+
+        Args:
+            directory (str): The directory result sets are saved to.
+            ttl (int): Seconds a saved result set is reused before the query is paginated again.
+
+        """
+        self.directory = directory
+        self.ttl = ttl
+
+    def __repr__(self):
+        return f"Saved result sets in {self.directory}."
+
+    def __str__(self):
+        return f"Saved result sets in {self.directory}."
+
+    @staticmethod
+    def key(request):
+        """Returns the key for a findObjects query.
+
+        The page size and session token don't change which PIDs match, so they're left out of the key.
+
+        """
+        query = re.sub(r"&(maxResults|sessionToken)=[^&]*", "", request)
+        return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+    def path(self, request):
+        return os.path.join(self.directory, f"{self.key(request)}.txt.gz")
+
+    def save(self, request, results, columns=None):
+        """Saves the PIDs for a query, and any fields captured with them.
+
+        Args:
+            request (str): The findObjects query the results came from.
+            results (list): The PIDs to save.
+            columns (dict): Optional field values to save with the PIDs, as sequences in the same order as results.
+
+        Returns:
+            str: The path the result set was written to.
+
+        Examples:
+            >>> ResultStore("result_sets").save(my_request, ['test:4', 'test:5', 'test:6'])
+            'result_sets/3c1f0e7e5a7dd2b4f9e5b1a8e8f0a1d4c1f2e3a4.txt.gz'
+
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        path = self.path(request)
+        fields = list(columns.keys()) if columns else []
+        with gzip.open(f"{path}.part", "wt", encoding="utf-8") as result_set:
+            result_set.write(json.dumps({"request": request, "created": time.time(), "size": len(results),
+                                         "fields": fields}) + "\n")
+            if len(fields) == 0:
+                for result in results:
+                    result_set.write(f"{result}\n")
+            else:
+                for row in zip(results, *[columns[field] for field in fields]):
+                    result_set.write(json.dumps(row) + "\n")
+        os.replace(f"{path}.part", path)
+        return path
+
+    def load(self, request, fields=()):
+        """Loads the PIDs for a query if they were saved less than ttl seconds ago with every field requested.
+
+        Args:
+            request (str): The findObjects query.
+            fields (tuple): Fields that must have been saved with the PIDs.
+
+        Returns:
+            tuple: The saved PIDs, a dict of saved field values and when they were saved (seconds since the epoch), or
+            None if nothing fresh is saved for this query.
+
+        """
+        path = self.path(request)
+        if not os.path.exists(path):
+            return None
+        header, results, columns = read_result_set(path)
+        if time.time() - header["created"] > self.ttl:
+            return None
+        if any(field not in columns for field in fields if field != "pid"):
+            return None
+        return results, columns, header["created"]
+
+    def saved_fields(self, request):
+        """Returns the fields saved with a query's last result set, so repopulating it can keep them."""
+        path = self.path(request)
+        if not os.path.exists(path):
+            return []
+        with gzip.open(path, "rt", encoding="utf-8") as result_set:
+            return json.loads(result_set.readline()).get("fields", [])
+
+
+def read_result_set(path):
+    with gzip.open(path, "rt", encoding="utf-8") as result_set:
+        header = json.loads(result_set.readline())
+        fields = header.get("fields", [])
+        if len(fields) == 0:
+            return header, [line.strip() for line in result_set if line.strip()], {}
+        rows = [json.loads(line) for line in result_set if line.strip()]
+    columns = {field: [row[position + 1] for row in rows] for position, field in enumerate(fields)}
+    return header, [row[0] for row in rows], columns
+
+
+def read_pid_file(path):
+    """Reads PIDs from a saved result set or a text file with one PID per line.
+
+    Text files like results.txt from write_results or pids_to_delete.txt from find_bad_books work as is.  Blank lines
+    and lines starting with # are skipped.
+
+    Args:
+        path (str): The file to read.
+
+    Returns:
+        list: The PIDs in the file, in order.
+
+    Examples:
+        >>> read_pid_file("pids_to_delete.txt")
+        ['test:4', 'test:5', 'test:6']
+
+    """
+    if path.endswith(".gz"):
+        return read_result_set(path)[1]
+    with open(path, "r") as pid_file:
+        return [line.strip() for line in pid_file if line.strip() and not line.startswith("#")]
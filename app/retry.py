@@ -0,0 +1,130 @@
+import json
+import os
+import time
+
+
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryQueue:
+    def __init__(self, path):
+        """Opens a JSON file of PIDs that failed, so they can be retried without repeating the whole query.
+
+        Each failure records the PID, the operation, the parameters it ran with (dsid, relationship, xpath, date and the
+        grab_images settings), the reason it failed (usually an http status code) and when.  Whenever an operation runs, the failures it had
+        before for the PIDs it just attempted are replaced by the ones it has now, so retries that succeed drop out of
+        the file.
+
+        Args:
+            path (str): The JSON file to keep failures in.
+
+        """
+        self.path = path
+        self.failures = []
+        if os.path.exists(self.path):
+            with open(self.path, "r") as failure_file:
+                self.failures = json.load(failure_file)["failures"]
+
+    def __repr__(self):
+        return f"{len(self.failures)} failures in {self.path}."
+
+    def __str__(self):
+        return f"{len(self.failures)} failures in {self.path}."
+
+    def __len__(self):
+        return len(self.failures)
+
+    def update(self, operation, parameters, attempted, errors):
+        """Replaces the failures of an operation for the PIDs it attempted with its new errors.
+
+        Args:
+            operation (str): The run.py operation.
+            parameters (dict): The parameters the operation ran with.
+            attempted (list): The PIDs the operation attempted.
+            errors (list): Errors as tuples with a PID and a reason, like failed_pids() returns.
+
+        Returns:
+            int: The number of failures recorded for this run.
+
+        Examples:
+            >>> RetryQueue("failures.json").update("grab_other", {"dsid": "OBJ"}, ['test:4', 'test:5'],
+            ...                                    [('test:5', 404)])
+            1
+
+        """
+        attempted = set(attempted)
+        self.failures = [failure for failure in self.failures
+                         if not (failure["operation"] == operation and failure["parameters"] == parameters
+                                 and failure["pid"] in attempted)]
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+        recorded = set()
+        for pid, reason in errors:
+            if pid in recorded:
+                continue
+            recorded.add(pid)
+            self.failures.append({"pid": pid, "operation": operation, "parameters": parameters,
+                                  "reason": reason if type(reason) in (int, str) or reason is None else repr(reason),
+                                  "failed": now})
+        self.save()
+        return len(recorded)
+
+    def pending(self):
+        """Groups failures by the operation and parameters needed to retry them.
+
+        Returns:
+            list: Tuples with an operation, its parameters, and the PIDs to retry with them.
+
+        Examples:
+            >>> RetryQueue("failures.json").pending()
+            [('grab_other', {'dsid': 'OBJ', 'relationship': None, 'xpath': None, 'date': None, 'image_format': None,
+            'image_max_dimension': None, 'image_colorspace': None}, ['test:5'])]
+
+        """
+        groups = {}
+        for failure in self.failures:
+            key = (failure["operation"], json.dumps(failure["parameters"], sort_keys=True))
+            if key not in groups:
+                groups[key] = (failure["operation"], failure["parameters"], [])
+            if failure["pid"] not in groups[key][2]:
+                groups[key][2].append(failure["pid"])
+        return list(groups.values())
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(f"{self.path}.part", "w") as failure_file:
+            json.dump({"failures": self.failures}, failure_file, indent=2)
+        os.replace(f"{self.path}.part", self.path)
+        return
+
+
+def failed_pids(output, results, statuses=TRANSIENT_STATUSES):
+    """Finds the errors worth retrying in what an operation returned, as tuples with a PID and a reason.
+
+    Errors with an http status code are only kept if the status is in statuses, so permanent misses like a 404 for a
+    page with no MODS aren't retried on every run.  Exceptions, like a dropped connection, are always kept.
+
+    Args:
+        output: The return value of a Set method.
+        results (list): The PIDs the operation ran against, used to recognize errors named for a PID and a date.
+        statuses (tuple): The http status codes to retry.
+
+    Returns:
+        list: Tuples with each PID that failed and why.
+
+    """
+    if type(output) is not dict:
+        return []
+    errors = output.get("errors", output.get("Errors", []))
+    results = set(results)
+    failures = []
+    for error in errors:
+        pid = error[0] if type(error) in (list, tuple) else error
+        reason = error[1] if type(error) in (list, tuple) and len(error) > 1 else None
+        if type(pid) is not str or (type(reason) is int and reason not in statuses):
+            continue
+        if pid not in results and "_" in pid and pid.rsplit("_", 1)[0] in results:
+            pid = pid.rsplit("_", 1)[0]
+        failures.append((pid, reason))
+    return failures
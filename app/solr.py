@@ -0,0 +1,155 @@
+from lxml import etree
+import requests
+import json
+from app.index import DC, MODS
+
+
+DEFAULT_FIELDS = {
+    "PID": "pid",
+    "fgs_label_s": "label",
+    "fgs_state_s": "state",
+    "fgs_ownerId_s": "owner_id",
+    "fgs_createdDate_dt": "created",
+    "fgs_lastModifiedDate_dt": "modified",
+    "dc.title": "dc:title",
+    "dc.creator": "dc:creator",
+    "dc.subject": "dc:subject",
+    "dc.description": "dc:description",
+    "dc.date": "dc:date",
+    "dc.identifier": "dc:identifier",
+    "mods_titleInfo_title_ms": "mods://mods:titleInfo/mods:title",
+}
+
+
+def dc_fields(content):
+    """Reads a DC datastream into a dict of each field and its values.
+
+    Args:
+        content (bytes): The oai_dc XML.
+
+    Returns:
+        dict: Each DC field name, like title, with a list of its values.
+
+    """
+    fields = {}
+    for field in etree.fromstring(content).iter():
+        if isinstance(field.tag, str) and field.tag.startswith(f"{{{DC}}}") and field.text:
+            fields.setdefault(etree.QName(field).localname, []).append(field.text.strip())
+    return fields
+
+
+class SolrIndexer:
+    def __init__(self, url, fields=None, batch_size=500, auth=None, session=None):
+        """Builds Solr documents from object properties, DC and MODS and posts them to Solr in batches.
+
+        Each key of fields is a Solr field and each value says where it comes from: an object property (pid, label,
+        state, owner_id, created or modified), dc: and a DC field name like dc:title, or mods: and an XPath into the
+        MODS like mods://mods:titleInfo/mods:title.  Fields with no value are left out of the document.  Nothing is
+        committed until finish(), so a full reindex costs one commit.
+
+        Args:
+            url (str): The Solr core, like http://localhost:8080/solr/collection1.
+            fields (dict): The field mapping.  Defaults to DEFAULT_FIELDS.
+            batch_size (int): How many documents to post at a time.
+            auth (tuple): An optional username and password for Solr.
+            session (requests.Session): The session to post with, like the one from get_session().  Defaults to a new
+                one.
+
+        """
+        self.url = url.rstrip("/")
+        self.fields = fields if fields else DEFAULT_FIELDS
+        self.batch_size = batch_size
+        self.auth = auth
+        self.session = session if session is not None else requests.Session()
+        self.batch = []
+        self.posted = 0
+        self.batches = 0
+        self.errors = []
+
+    def __repr__(self):
+        return f"Solr indexer posting to {self.url} in batches of {self.batch_size}."
+
+    def __str__(self):
+        return f"Solr indexer posting to {self.url} in batches of {self.batch_size}."
+
+    def needs_mods(self):
+        return any(source.startswith("mods:") for source in self.fields.values())
+
+    def document(self, pid, properties, dc=None, mods=None):
+        """Builds the Solr document for an object.
+
+        Args:
+            pid (str): The PID of the object.
+            properties (dict): The object's label, state, owner_id, created and modified values.
+            dc (dict): DC fields and their values, like from dc_fields().
+            mods (bytes): The MODS XML, if the mapping uses it.
+
+        Returns:
+            dict: The Solr document.
+
+        Examples:
+            >>> SolrIndexer("http://localhost:8080/solr/collection1").document("test:4", {"label": "A Book"},
+            ...                                                              {"title": ["A Book"]})
+            {'PID': 'test:4', 'fgs_label_s': 'A Book', 'dc.title': ['A Book']}
+
+        """
+        properties = dict(properties, pid=pid)
+        mods_document = etree.fromstring(mods) if mods else None
+        document = {}
+        for field, source in self.fields.items():
+            if source.startswith("dc:"):
+                value = (dc or {}).get(source[3:], [])
+            elif source.startswith("mods:"):
+                if mods_document is None:
+                    continue
+                value = [match.text.strip() if isinstance(match, etree._Element) else str(match).strip()
+                         for match in mods_document.xpath(source[5:], namespaces={"mods": MODS})
+                         if not isinstance(match, etree._Element) or match.text]
+            else:
+                value = properties.get(source)
+            if value is not None and value != [] and value != "":
+                document[field] = value
+        return document
+
+    def add(self, pid, document):
+        self.batch.append((pid, document))
+        if len(self.batch) >= self.batch_size:
+            self.post()
+        return
+
+    def post(self):
+        if len(self.batch) == 0:
+            return
+        try:
+            r = self.session.post(f"{self.url}/update", data=json.dumps([document for pid, document in self.batch]),
+                                  headers={"Content-Type": "application/json"}, auth=self.auth)
+        except requests.exceptions.RequestException as error:
+            self.errors += [(pid, repr(error)) for pid, document in self.batch]
+        else:
+            if r.status_code == 200:
+                self.posted += len(self.batch)
+            else:
+                self.errors += [(pid, r.status_code) for pid, document in self.batch]
+        self.batches += 1
+        self.batch = []
+        return
+
+    def finish(self):
+        """Posts any documents left and commits once.
+
+        The commit is sent even if some batches failed, so the documents that were posted become searchable.
+
+        Returns:
+            dict: A dict with the documents posted, the number of batches, whether the commit worked, and a list of
+            errors as tuples with the PID and the http status code of its batch or the exception that stopped it.
+
+        """
+        self.post()
+        try:
+            r = self.session.post(f"{self.url}/update", data=json.dumps({"commit": {}}),
+                                  headers={"Content-Type": "application/json"}, auth=self.auth)
+            committed = r.status_code == 200
+        except requests.exceptions.RequestException:
+            committed = False
+        return {"Documents posted": self.posted, "Batches": self.batches, "Committed": committed,
+                "errors": self.errors}
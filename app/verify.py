@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import hashlib
+import os
+
+
+ALGORITHMS = {"MD5": "md5", "SHA-1": "sha1", "SHA-256": "sha256", "SHA-384": "sha384", "SHA-512": "sha512"}
+
+
+def mime_extension(mimetype):
+    """Finds the file extension for a mime type, like jpeg for image/jpeg.
+
+    Args:
+        mimetype (str): A mime type, optionally with parameters like charset.
+
+    Returns:
+        str: The subtype, or bin if the mime type is empty or malformed.
+
+    Examples:
+        >>> mime_extension("text/xml; charset=utf-8")
+        'xml'
+
+    """
+    parts = (mimetype or "").split(";")[0].split("/")
+    if len(parts) != 2 or parts[1].strip() == "":
+        return "bin"
+    return parts[1].strip()
+
+
+def hash_file(path, checksum_type, chunk_size=1048576):
+    """Hashes a file in chunks so large binaries never have to fit in memory.
+
+    This runs in a worker process.
+
+    Args:
+        path (str): The file to hash.
+        checksum_type (str): A Fedora checksum type like MD5 or SHA-1.
+        chunk_size (int): How many bytes to read at a time.
+
+    Returns:
+        str: The hex digest.
+
+    """
+    digest = hashlib.new(ALGORITHMS[checksum_type])
+    with open(path, "rb") as local_file:
+        for chunk in iter(lambda: local_file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_directory(expected, directory, workers=None):
+    """Compares the files in a directory with the sizes and checksums Fedora reports for them.
+
+    Sizes are checked first, and only files of the right size are hashed, in a pool of worker processes.  A checksum of
+    none or a checksum type of DISABLED means only the size is checked, and a size of 0 (which Fedora reports for most
+    inline datastreams) means the size isn't checked.
+
+    Args:
+        expected (dict): Each file name expected in directory, with a dict holding its pid, size, checksum_type and
+            checksum.
+        directory (str): The directory to check.
+        workers (int): The number of processes hashing files.  Defaults to the number of CPUs.
+
+    Returns:
+        dict: A dict with the number of files verified, and lists of mismatched files (with what was expected and
+        found), missing files, extra files with the same extensions as the expected ones, and files that couldn't be
+        checked because Fedora has neither a size nor a checksum for them.
+
+    """
+    mismatched = []
+    missing = []
+    unchecked = []
+    to_hash = []
+    verified = 0
+    for name, details in sorted(expected.items()):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            missing.append(name)
+            continue
+        size = os.path.getsize(path)
+        if details["size"] and size != details["size"]:
+            mismatched.append({"file": name, "pid": details["pid"], "expected size": details["size"], "size": size})
+        elif details["checksum"] not in (None, "", "none") and details["checksum_type"] in ALGORITHMS:
+            to_hash.append((name, path, details))
+        elif details["size"]:
+            verified += 1
+        else:
+            unchecked.append(name)
+    with ProcessPoolExecutor(workers) as pool:
+        digests = list(tqdm(pool.map(hash_file, [path for name, path, details in to_hash],
+                                     [details["checksum_type"] for name, path, details in to_hash], chunksize=16),
+                            total=len(to_hash)))
+    for (name, path, details), digest in zip(to_hash, digests):
+        if digest == details["checksum"].lower():
+            verified += 1
+        else:
+            mismatched.append({"file": name, "pid": details["pid"], "checksum_type": details["checksum_type"],
+                               "expected checksum": details["checksum"], "checksum": digest})
+    extensions = {os.path.splitext(name)[1] for name in expected}
+    extra = sorted(name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name))
+                   and os.path.splitext(name)[1] in extensions and name not in expected)
+    return {"Files expected": len(expected), "verified": verified, "mismatched": mismatched, "missing": missing,
+            "extra": extra, "unchecked": unchecked, "directory": directory}
@@ -1,45 +1,83 @@
 import yaml
 import argparse
-from app.fedora import Set, Record
-from time import sleep
+from app.fedora import Set
+from app.index import FoxmlIndex, OfflineSet
+from app.planner import SinglePass, FUSABLE_OPERATIONS
+from app.resultsets import ResultStore, read_pid_file
+from app.daemon import Daemon
+from app.profiler import ProfileSession
+from app.retry import RetryQueue, failed_pids, TRANSIENT_STATUSES
+from app.solr import SolrIndexer
+from app.cache import get_session
+from time import sleep, time, strftime
+
+OFFLINE_OPERATIONS = ("count_objects", "list_dsids", "get_datastream_report", "find_missing", "test_obj_mimes",
+                      "find_bad_books", "find_pages_per_book", "find_content_type", "find_matching_relationship",
+                      "write_results", "verify_files", "index_solr")
+
+WRITE_OPERATIONS = ("update_labels", "purge_old_dsids", "update_gsearch", "update_gsearch_no_pages", "index_solr")
+
+FIELD_OPERATIONS = {"objects_by_state": ("state",), "modified_since": ("mDate",),
+                    "index_solr": ("label", "state", "ownerId", "cDate", "mDate")}
 
 
 def choose_operation(choice, instance, ds=None, predicate=None, xpath=None, as_of_date=None, yaml_settings=None):
+    output = None
     if ds is None:
         ds = yaml_settings["default_dsid"]
     if choice == "grab_images":
-        print(instance.grab_images(ds))
+        output = instance.grab_images(ds, yaml_settings.get("image_format"), yaml_settings.get("image_max_dimension"),
+                                      yaml_settings.get("image_colorspace"))
+        print(output)
     elif choice == "update_gsearch":
-        print(instance.update_gsearch())
+        output = instance.update_gsearch()
+        print(output)
+    elif choice == "index_solr":
+        output = instance.index_solr(SolrIndexer(yaml_settings["solr_url"], yaml_settings.get("solr_fields"),
+                                                 yaml_settings.get("solr_batch_size", 500),
+                                                 session=get_session(yaml_settings)))
+        print(output)
     elif choice == "update_gsearch_no_pages":
         memberships = instance.find_rels_ext_relationship("isMemberOf")
         for pid in memberships:
             instance.results.remove(pid["pid"])
-        instance.update_gsearch()
+        output = instance.update_gsearch()
     elif choice == "grab_foxml":
-        print(instance.grab_foxml())
+        output = instance.grab_foxml()
+        print(output)
     elif choice == "harvest_metadata":
-        instance.harvest_metadata(ds)
+        output = instance.harvest_metadata(ds)
     elif choice == "find_missing":
         print(instance.find_objects_missing_datastream(ds))
     elif choice == "list_dsids":
-        print(instance.list_dsids()['Unique dsids'])
+        output = instance.list_dsids()
+        print(output['Unique dsids'])
     elif choice == "get_datastream_report":
         print(instance.get_datastream_report())
     elif choice == "get_relationships":
         instance.get_relationships()
     elif choice == "grab_other":
-        print(instance.grab_binary(ds))
+        output = instance.grab_binary(ds)
+        print(output)
     elif choice == "find_content_type":
         print(instance.find_content_types())
     elif choice == "write_results":
         instance.write_results_to_file()
     elif choice == "get_history":
-        print(instance.write_datastream_history(ds))
+        output = instance.write_datastream_history(ds)
+        print(output)
     elif choice == "get_datastream_at_date":
-        print(instance.get_datastream_at_date(ds, as_of_date))
+        output = instance.get_datastream_at_date(ds, as_of_date)
+        print(output)
+    elif choice == "export_snapshot":
+        if as_of_date is not None:
+            output = instance.export_snapshot(ds, as_of_date)
+            print(output)
+        else:
+            print("Must specify a date with -d.")
     elif choice == "get_all_versions_of_datastream":
-        print(instance.write_all_versions_of_datastream(ds))
+        output = instance.write_all_versions_of_datastream(ds)
+        print(output)
     elif choice == "test_obj_mimes":
         x = instance.check_obj_mime_types()
         print("\nHere are the unique mime types in your result set:")
@@ -50,28 +88,20 @@ def choose_operation(choice, instance, ds=None, predicate=None, xpath=None, as_o
         print(memberships)
     elif choice == "update_labels":
         if xpath is not None:
-            for result in instance.results:
-                new_record = Record(result)
-                relationships = new_record.find_rels_ext_relationship("isMemberOf")
-                if relationships is not None:
-                    print(f"Finding parent of page {result}.")
-                    parent = Record(relationships["isMemberOf"])
-                    label = parent.get_parent_label(xpath)
-                    new_record.update_fgs_label(xpath, f"{label}:  page {relationships['page number']}")
-                else:
-                    new_record.update_fgs_label(xpath)
+            output = instance.update_labels(xpath)
+            print(output)
         else:
             print("Must specify xpath value.")
     elif choice == "harvest_metadata_no_pages":
         memberships = instance.find_rels_ext_relationship("isMemberOf")
         for pid in memberships:
             instance.results.remove(pid["pid"])
-        instance.harvest_metadata(ds)
+        output = instance.harvest_metadata(ds)
     elif choice == "grab_thumbnails_no_pages":
         memberships = instance.find_rels_ext_relationship("isMemberOf")
         for pid in memberships:
             instance.results.remove(pid["pid"])
-        instance.grab_binary('TN')
+        output = instance.grab_binary('TN')
     elif choice == "find_bad_books":
         # Set some variables
         if predicate is None:
@@ -106,44 +136,101 @@ def choose_operation(choice, instance, ds=None, predicate=None, xpath=None, as_o
             book_total += 1
     elif choice == "count_objects":
         print(f"\n\nTotal matching documents: {instance.count_objects()}")
-    elif choice == "test_embargos":
-        instance.test_embargos()
+    elif choice == "test_embargos" or choice == "audit_embargoes":
+        output = instance.audit_embargoes()
+        print(f"\n\nFound {output['Embargoes']} embargoes on {output['PIDs checked']} objects. "
+              f"Each is listed in {output['report']}.")
+        for window, embargoes in output["windows"].items():
+            print(f"\t{len(embargoes)} {window}.")
     elif choice == "purge_old_dsids":
         if ds is not None:
             instance.purge_all_but_newest_dsid(ds)
         else:
             print("\n\nYou need to define a datastream to purge.")
+    elif choice == "objects_by_state":
+        print("\nHere are the object states in your result set:")
+        for state, objects in instance.objects_by_state().items():
+            print(f"\t{objects['count']} objects are {state}.")
+    elif choice == "modified_since":
+        if as_of_date is not None:
+            print(f"\n{instance.modified_since(as_of_date)}")
+        else:
+            print("Must specify a date with -d.")
+    elif choice == "verify_files":
+        output = instance.verify_files(ds)
+        print(f"\n\n{output['verified']} of {output['Files expected']} files in {output['directory']} match Fedora.")
+        for problem in ("mismatched", "missing", "extra", "unchecked", "errors"):
+            if len(output[problem]) > 0:
+                print(f"\n{len(output[problem])} {problem}:")
+                for item in output[problem]:
+                    print(f"\t{item}")
     elif choice == "find_pages_per_book":
-        books = []
-        book_list = []
-        for result in instance.results:
-            new_record = Record(result)
-            relationships = new_record.find_rels_ext_relationship("isMemberOf")
-            if relationships is not None:
-                print(f"Finding parent of page {result}.")
-                parent = Record(relationships["isMemberOf"])
-                if parent.pid not in books:
-                    books.append(parent.pid)
-                    try:
-                        label = parent.get_parent_label("//mods:identifier[@type='local']")
-                    except IndexError:
-                        label = "missing"
-                    except OSError:
-                        label = "Access Denied"
-                    try:
-                        extent = parent.get_parent_label("//mods:extent")
-                    except IndexError:
-                        extent = "missing"
-                    except OSError:
-                        extent = "Access Denied"
-                    book_list.append({"name": parent.pid,  "pages": 1, "admindb": label, "extent_pages": extent})
-                else:
-                    for book in book_list:
-                        if book["name"] == parent.pid:
-                            book["pages"] += 1
-        print(book_list)
+        print(instance.find_pages_per_book())
     else:
         print("No valid operator.")
+    return output
+
+
+def run_operations(operations, instance, ds=None, predicate=None, xpath=None, as_of_date=None, yaml_settings=None):
+    """Runs each operation against instance, fusing the ones that read the same per-object data into one pass."""
+    fused = [operation for operation in operations if operation in FUSABLE_OPERATIONS]
+    single_pass = None
+    if len(fused) > 1 and not isinstance(instance, OfflineSet):
+        single_pass = SinglePass(instance, fused, ds if ds is not None else yaml_settings["default_dsid"], predicate)
+        print(single_pass.run())
+    retry_queue = RetryQueue(yaml_settings["retry_file"]) \
+        if yaml_settings.get("retry_file") and not isinstance(instance, OfflineSet) else None
+    parameters = {"dsid": ds, "relationship": predicate, "xpath": xpath, "date": as_of_date,
+                  "image_format": yaml_settings.get("image_format"),
+                  "image_max_dimension": yaml_settings.get("image_max_dimension"),
+                  "image_colorspace": yaml_settings.get("image_colorspace")}
+    statuses = tuple(yaml_settings.get("retry_statuses", TRANSIENT_STATUSES))
+    original_results = list(instance.results)
+    for operation in operations:
+        if len(operations) > 1:
+            print(f"\n\n{operation}:")
+        if single_pass is not None and operation in fused:
+            output = choose_operation(operation, single_pass, ds, predicate, xpath, as_of_date, yaml_settings)
+        else:
+            output = choose_operation(operation, instance, ds, predicate, xpath, as_of_date, yaml_settings)
+        if retry_queue is not None and type(output) is dict:
+            failures = failed_pids(output, instance.results, statuses)
+            retry_queue.update(operation, parameters, instance.results, failures)
+            if len(failures) > 0:
+                print(f"\n{len(failures)} failed PIDs saved to {retry_queue.path}. Rerun them with --retry.")
+        instance.results = list(original_results)
+    return
+
+
+def retry_failures(settings):
+    """Runs each operation in the retry file again against only the PIDs that failed, with the same parameters."""
+    pending = RetryQueue(settings["retry_file"]).pending()
+    if len(pending) == 0:
+        print(f"\nNothing to retry in {settings['retry_file']}.")
+        return
+    for operation, parameters, pids in pending:
+        print(f"\n\nRetrying {operation} for {len(pids)} PIDs.")
+        retry_settings = dict(settings)
+        for setting in ("image_format", "image_max_dimension", "image_colorspace"):
+            retry_settings[setting] = parameters.get(setting)
+        instance = Set(settings["fedora_path"], retry_settings)
+        instance.load_results(pids)
+        run_operations([operation], instance, parameters["dsid"], parameters["relationship"], parameters["xpath"],
+                       parameters["date"], retry_settings)
+    print(f"\n\n{RetryQueue(settings['retry_file'])}")
+    return
+
+
+def profile_operations(mode, operations, instance, ds=None, predicate=None, xpath=None, as_of_date=None,
+                       yaml_settings=None):
+    """Runs the operations, inside a profile session if mode is sample or cprofile."""
+    if mode is None:
+        run_operations(operations, instance, ds, predicate, xpath, as_of_date, yaml_settings)
+        return
+    name = f"{'_'.join(operations)}_{strftime('%Y%m%d_%H%M%S')}"
+    with ProfileSession(mode, yaml_settings.get("profile_directory", "profiles"), name,
+                        yaml_settings.get("profile_top", 20)):
+        run_operations(operations, instance, ds, predicate, xpath, as_of_date, yaml_settings)
     return
 
 
@@ -164,29 +251,78 @@ def add_a_book(a_parent):
     return {"name": a_parent.pid, "pages": 1, "admindb": label}
 
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description='Use to specify a collection')
     parser.add_argument("-p", "--parentnamespace", dest="parent_namespace", help="parent namespace of collection")
     parser.add_argument("-dc", "--dcfield", dest="dc_field", help="grab pids according to dc field")
     parser.add_argument("-dcs", "--dcstring", dest="dc_string", help="specify a dc string")
     parser.add_argument("-ds", "--dsid", dest="datastream_id", help="specify text datastream.")
     parser.add_argument('-d', "--date", dest="as_of_date", help="if using get_datastream_at_date, specify a date")
-    parser.add_argument("-o", "--operation", dest="operation", help="Choose one: grab_images, harvest_metadata, "
-                                                                    "grab_other, update_gsearch, find_missing, "
-                                                                    "get_relationships, find_bad_books, update_labels, "
-                                                                    "harvest_metadata_no_pages, grab_foxml, "
-                                                                    "count_objects, update_gsearch_no_pages, "
-                                                                    "purge_old_dsids, write_results, get_history,"
-                                                                    "get_datastream_at_date,"
-                                                                    "get_all_versions_of_datastream,"
-                                                                    "grab_thumbnails_no_pages, get_datastream_report",
-                        required=True)
+    parser.add_argument("-o", "--operation", dest="operation", nargs="+",
+                        help="Choose one or more: grab_images, harvest_metadata, "
+                             "grab_other, update_gsearch, find_missing, "
+                             "get_relationships, find_bad_books, update_labels, "
+                             "harvest_metadata_no_pages, grab_foxml, "
+                             "count_objects, update_gsearch_no_pages, "
+                             "purge_old_dsids, write_results, get_history,"
+                             "get_datastream_at_date,"
+                             "get_all_versions_of_datastream,"
+                             "grab_thumbnails_no_pages, get_datastream_report,"
+                             "find_pages_per_book, index_foxml, objects_by_state,"
+                             "modified_since, export_snapshot, verify_files, "
+                             "audit_embargoes, index_solr. "
+                             "Operations that read the same per-object data "
+                             "run in one pass.")
     parser.add_argument("-r", "--relationship", dest="relationship", help="Specify the relationship to check for.")
     parser.add_argument("-xp", "--xpath", dest="xpath", help="Specify an xpath value to find. Used in update_label.")
-    args = parser.parse_args()
+    parser.add_argument("--image-format", dest="image_format",
+                        help="Used in grab_images. Convert images to this format, like png or jpeg.")
+    parser.add_argument("--max-dimension", dest="max_dimension", type=int,
+                        help="Used in grab_images. Shrink images so neither side is longer than this.")
+    parser.add_argument("--colorspace", dest="colorspace", choices=["sRGB", "Gray", "CMYK"],
+                        help="Used in grab_images. Convert images to this colorspace.")
+    parser.add_argument("--offline", dest="offline", action="store_true",
+                        help="Answer the operation from the FOXML snapshot index instead of Fedora.")
+    parser.add_argument("--fields", dest="fields", nargs="+", default=[],
+                        help="Other findObjects fields to capture while populating, like label state ownerId cDate "
+                             "mDate.")
+    parser.add_argument("--pid-file", dest="pid_file",
+                        help="Load the result set from a saved result set or a text file of PIDs instead of querying.")
+    parser.add_argument("--partition", dest="partition", action="store_true",
+                        help="Split the query by PID prefix and page the parts concurrently while populating.")
+    parser.add_argument("--reuse", dest="reuse", action="store_true",
+                        help="Reuse a result set saved for this query within result_set_ttl seconds instead of "
+                             "paginating it again. Never applies to operations that write.")
+    parser.add_argument("--refresh", dest="refresh", action="store_true",
+                        help="Ignore any saved result set for this query and paginate it again.")
+    parser.add_argument("--profile", dest="profile", nargs="?", const="sample", choices=["sample", "cprofile"],
+                        help="Profile the operations and write a flamegraph-ready file and a summary to "
+                             "profile_directory.")
+    parser.add_argument("--retry", dest="retry", action="store_true",
+                        help="Run the operations saved in retry_file again for only the PIDs that failed.")
+    parser.add_argument("--serve", dest="serve", action="store_true",
+                        help="Start a daemon that keeps connections and result sets warm and runs operations sent by "
+                             "whitebread_client.py.")
+    return parser
 
-    settings = yaml.safe_load(open("config.yml", "r"))
 
+def execute(args, settings, loaded_sets=None):
+    """Runs the operations in parsed run.py arguments.
+
+    Args:
+        args (argparse.Namespace): Arguments from build_parser().
+        settings (dict): A dict of various setting predefined by the user in a config file.
+        loaded_sets (dict): Result sets kept in memory between calls by the daemon, keyed by request.
+
+    """
+    settings = dict(settings)
+    for setting, value in (("image_format", args.image_format), ("image_max_dimension", args.max_dimension),
+                           ("image_colorspace", args.colorspace)):
+        if value is not None:
+            settings[setting] = value
+    if args.retry:
+        retry_failures(settings)
+        return
     fedora_collection = dc_parameter = ""
     relationship = dsid = my_xpath = my_date = None
     if args.relationship:
@@ -196,7 +332,7 @@ def main():
         fedora_url = f"http://{fedora_url}"
     if args.parent_namespace:
         fedora_collection = f"pid%7E{args.parent_namespace}*"
-    operation = args.operation
+    operations = [operation for value in args.operation for operation in value.split(",") if operation]
     if args.dc_field and args.dc_string:
         dc_parameter = f"{args.dc_field}%7E%27{args.dc_string}%27"
     elif args.dc_field or args.dc_string:
@@ -207,13 +343,95 @@ def main():
         my_xpath = args.xpath
     if args.as_of_date:
         my_date = args.as_of_date
+    if "index_foxml" in operations:
+        index = FoxmlIndex(settings.get("foxml_index", "foxml_index.db"))
+        print(index.build(settings["destination_directory"]))
+        operations.remove("index_foxml")
+        if len(operations) == 0:
+            return
+    if args.offline:
+        for operation in operations:
+            if operation not in OFFLINE_OPERATIONS:
+                print(f"{operation} can't run offline. Choose from: {', '.join(OFFLINE_OPERATIONS)}.")
+                return
+        index = FoxmlIndex(settings.get("foxml_index", "foxml_index.db"))
+        my_records = OfflineSet(index, index.find_pids(args.parent_namespace, args.dc_field, args.dc_string),
+                                settings)
+        profile_operations(args.profile, operations, my_records, dsid, relationship, my_xpath, my_date, settings)
+        return
     my_request = f"{fedora_url}:8080/fedora/objects?query={fedora_collection}{dc_parameter}" \
                  f"&pid=true&resultFormat=xml&maxResults={settings['max_results']}".replace(" ", "%20")
     my_records = Set(my_request, settings)
-    print("\nPopulating results set.", end="", flush=True)
-    while my_records.token is not None:
-        my_records.populate()
-    choose_operation(operation, my_records, dsid, relationship, my_xpath, my_date, settings)
+    store = ResultStore(settings["result_sets"], settings.get("result_set_ttl", 3600)) \
+        if settings.get("result_sets") else None
+    fields = list(args.fields)
+    for operation in operations:
+        for field in FIELD_OPERATIONS.get(operation, ()):
+            if field not in fields:
+                fields.append(field)
+    reuse = (args.reuse or settings.get("reuse_result_sets", False)) and not args.refresh
+    writes = [operation for operation in operations if operation in WRITE_OPERATIONS]
+    if reuse and len(writes) > 0:
+        print(f"\n{', '.join(writes)} changes objects, so the query is paginated again instead of reusing a saved "
+              f"result set.")
+        reuse = False
+    saved_results = None
+    if args.pid_file:
+        saved_results = (read_pid_file(args.pid_file), {})
+        print(f"\nLoaded {len(saved_results[0])} PIDs from {args.pid_file}.")
+    elif reuse and loaded_sets is not None and my_request in loaded_sets:
+        loaded, results, columns = loaded_sets[my_request]
+        if time() - loaded < settings.get("result_set_ttl", 3600) and all(field in columns for field in fields):
+            saved_results = (results, columns)
+            saved_at = loaded
+    if saved_results is None and store is not None and reuse:
+        saved = store.load(my_request, fields)
+        if saved is not None:
+            saved_results, saved_at = saved[:2], saved[2]
+    if saved_results is not None:
+        if not args.pid_file:
+            print(f"\nLoaded {len(saved_results[0])} PIDs from a result set saved {int(time() - saved_at)} seconds "
+                  f"ago. Use --refresh to query Fedora again.")
+        my_records.load_results(*saved_results)
+    else:
+        if store is not None:
+            fields += [field for field in store.saved_fields(my_request) if field not in fields]
+        print("\nPopulating results set.", end="", flush=True)
+        my_records.populate_all(fields, args.partition or settings.get("partition_populate", False))
+        if store is not None:
+            store.save(my_request, my_records.results, my_records.columns)
+    if loaded_sets is not None and not args.pid_file:
+        loaded_sets[my_request] = (time(), list(my_records.results),
+                                   {field: list(column) for field, column in my_records.columns.items()})
+    profile_operations(args.profile, operations, my_records, dsid, relationship, my_xpath, my_date, settings)
+
+
+def serve(settings):
+    parser = build_parser()
+    loaded_sets = {}
+
+    def handle(argv):
+        args = parser.parse_args(argv)
+        if not args.operation and not args.retry:
+            parser.error("the following arguments are required: -o/--operation")
+        if args.operation and "purge_old_dsids" in args.operation:
+            print("purge_old_dsids asks for confirmation, so run it with run.py instead of the daemon.")
+            return
+        execute(args, settings, loaded_sets)
+
+    Daemon(settings.get("daemon_socket", "whitebread.sock"), handle).serve_forever()
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    settings = yaml.safe_load(open("config.yml", "r"))
+    if args.serve:
+        serve(settings)
+    elif not args.operation and not args.retry:
+        parser.error("the following arguments are required: -o/--operation")
+    else:
+        execute(args, settings)
 
 
 if __name__ == "__main__":
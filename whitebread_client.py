@@ -0,0 +1,35 @@
+import socket
+import json
+import sys
+
+
+def main():
+    """Sends run.py arguments to a running whitebread daemon and prints what it streams back.
+
+    Only the standard library is imported so each call starts quickly.  Use --socket PATH before the run.py
+    arguments if the daemon isn't listening on whitebread.sock, and --stop to shut it down.
+
+    """
+    argv = sys.argv[1:]
+    socket_path = "whitebread.sock"
+    if len(argv) >= 2 and argv[0] == "--socket":
+        socket_path = argv[1]
+        argv = argv[2:]
+    request = {"stop": True} if argv == ["--stop"] else {"argv": argv}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            print(f"No whitebread daemon is listening on {socket_path}. Start one with: python run.py --serve")
+            sys.exit(1)
+        connection.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()